@@ -11,7 +11,7 @@ Endpoints:
 - POST /v1/chats              (create new chat)
 - PUT  /v1/chats/<id>         (update chat)
 - DELETE /v1/chats/<id>       (delete chat)
-- GET  /v1/messages/<chat_id> (get messages for chat)
+- GET  /v1/messages/<chat_id> (get messages for chat; ?decode=0 leaves JSON columns as strings)
 - POST /v1/messages/<chat_id> (add message to chat)
 - DELETE /v1/messages/<msg_id> (delete message)
 - POST /v1/tools              (execute a tool directly)
@@ -26,15 +26,26 @@ This server is managed by systemd, NOT Quickshell.
 
 from __future__ import annotations
 
+import functools
+import itertools
 import json
 import os
+import queue
 import re
 import sqlite3
 import sys
 import threading
+import time
+from contextlib import contextmanager
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib path produces the same JSON
+    orjson = None
 
 # Allow running as both module and script
 if __name__ == "__main__":
@@ -50,6 +61,19 @@ else:
     from .upstream import UpstreamClient, ProxyError
     from .streaming import StreamHandler
 
+# ─────────────────────────────────────────────────────────────────────────────
+# JSON
+# ─────────────────────────────────────────────────────────────────────────────
+
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    _loads = json.loads  # accepts bytes and str
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Database
 # ─────────────────────────────────────────────────────────────────────────────
@@ -60,17 +84,46 @@ if not DB_PATH or DB_PATH == Path(""):
 
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-_db_lock = threading.Lock()
-
-
-def _get_db() -> sqlite3.Connection:
-    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
+# One writer thread owns the writer connection and applies queued write ops,
+# plus a pool of reader connections. In WAL mode readers never block on the
+# writer, and HTTP threads never sit on a lock while a commit fsyncs.
+_writer_lock = threading.Lock()
+
+
+def _get_db(writer: bool = False) -> sqlite3.Connection:
+    # The writer takes the RESERVED lock up front (BEGIN IMMEDIATE) so a
+    # write transaction can't fail midway with SQLITE_BUSY.
+    conn = sqlite3.connect(
+        str(DB_PATH),
+        check_same_thread=False,
+        isolation_level="IMMEDIATE" if writer else "",
+        # Every statement we run is a fixed string, so a roomier per-connection
+        # statement cache means each one is parsed and planned only once.
+        cached_statements=256,
+    )
     conn.row_factory = sqlite3.Row
+    # WAL lets readers proceed while the streamer commits, and NORMAL sync
+    # drops commits to a single fsync. journal_mode is persisted in the DB
+    # header; the rest are per-connection.
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -65536")
+    conn.execute("PRAGMA mmap_size = 268435456")
+    conn.execute("PRAGMA busy_timeout = 5000")
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
 
+# Bump when _init_db gains a migration step. Databases already at this
+# version skip the whole schema check on startup.
+_SCHEMA_VERSION = 2
+
+
 def _init_db(conn: sqlite3.Connection) -> None:
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= _SCHEMA_VERSION:
+        return
+
     conn.executescript("""
         CREATE TABLE IF NOT EXISTS chats (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -99,7 +152,27 @@ def _init_db(conn: sqlite3.Connection) -> None:
             annotation_sources TEXT DEFAULT '[]',
             created_at REAL NOT NULL DEFAULT (strftime('%s', 'now'))
         );
+        -- id is the rowid, so this index is already (chat_id, id): it serves
+        -- the chat timeline's WHERE chat_id = ? ORDER BY id without a sort.
         CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id);
+        -- Chat listing and the empty-chat prune both order by updated_at.
+        CREATE INDEX IF NOT EXISTS idx_chats_updated_at ON chats(updated_at);
+        -- Tool-call data lives in a side table: most messages have none, and
+        -- keeping it out of `messages` keeps the rows a chat fetch reads narrow.
+        -- The old columns on `messages` stay for compatibility but are unused.
+        CREATE TABLE IF NOT EXISTS message_tool_calls (
+            message_id INTEGER PRIMARY KEY REFERENCES messages(id) ON DELETE CASCADE,
+            function_name TEXT NOT NULL DEFAULT '',
+            function_call TEXT NOT NULL DEFAULT '',
+            function_response TEXT NOT NULL DEFAULT '',
+            tool_calls TEXT NOT NULL DEFAULT '[]'
+        );
+        -- Keep chats.updated_at fresh without a second statement per insert.
+        -- add_message binds created_at, so the trigger reuses it.
+        CREATE TRIGGER IF NOT EXISTS trg_msg_touch_chat AFTER INSERT ON messages
+        BEGIN
+            UPDATE chats SET updated_at = NEW.created_at WHERE id = NEW.chat_id;
+        END;
     """)
 
     # Lightweight schema migration for existing installs.
@@ -118,18 +191,99 @@ def _init_db(conn: sqlite3.Connection) -> None:
     if "usage_estimated" not in cols:
         conn.execute("ALTER TABLE messages ADD COLUMN usage_estimated INTEGER NOT NULL DEFAULT 0")
 
+    # Move tool-call data written by older versions into message_tool_calls.
+    # Once moved, the source columns are reset, so this is a no-op afterwards.
+    has_tool_data = """
+        COALESCE(function_name, '') != ''
+        OR COALESCE(function_call, '') != ''
+        OR COALESCE(function_response, '') != ''
+        OR COALESCE(tool_calls, '') NOT IN ('', '[]')
+    """
+    conn.execute(f"""
+        INSERT OR REPLACE INTO message_tool_calls
+               (message_id, function_name, function_call, function_response, tool_calls)
+        SELECT id, COALESCE(function_name, ''), COALESCE(function_call, ''),
+               COALESCE(function_response, ''), COALESCE(NULLIF(tool_calls, ''), '[]')
+          FROM messages
+         WHERE {has_tool_data}
+    """)
+    conn.execute(f"""
+        UPDATE messages
+           SET function_name = '', function_call = '', function_response = '', tool_calls = '[]'
+         WHERE {has_tool_data}
+    """)
+
+    conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
     conn.commit()
 
 
 _db_conn: Optional[sqlite3.Connection] = None
+_read_pool: List[sqlite3.Connection] = []
+_write_queue: "queue.Queue[Tuple[Callable[[sqlite3.Connection], Any], threading.Event, list]]" = queue.Queue()
+_writer_thread: Optional[threading.Thread] = None
+
+
+def open_db() -> None:
+    """Open the writer connection, bring the schema up to date and start the
+    writer thread. Must run once before any of the CRUD functions are used.
+    """
+    global _db_conn, _writer_thread
+    with _writer_lock:
+        if _writer_thread is not None:
+            return
+        _db_conn = _get_db(writer=True)
+        _init_db(_db_conn)
+        _writer_thread = threading.Thread(
+            target=_writer_loop, name="ii-ai-db-writer", daemon=True
+        )
+        _writer_thread.start()
 
 
-def get_db() -> sqlite3.Connection:
-    global _db_conn
-    if _db_conn is None:
-        _db_conn = _get_db()
-        _init_db(_db_conn)
-    return _db_conn
+def _writer_loop() -> None:
+    conn = _db_conn
+    while True:
+        fn, done, out = _write_queue.get()
+        try:
+            out[0] = fn(conn)
+            conn.commit()
+        except BaseException as e:
+            conn.rollback()
+            out[1] = e
+        finally:
+            done.set()
+
+
+def _write(fn: Callable[[sqlite3.Connection], Any]) -> Any:
+    """Run fn(conn) as one transaction on the writer thread and return its result.
+
+    Commits once on success and rolls back on error (re-raised here).
+    """
+    assert _writer_thread is not None, "open_db() has not been called"
+    done = threading.Event()
+    out: list = [None, None]  # [result, exception]
+    _write_queue.put((fn, done, out))
+    done.wait()
+    if out[1] is not None:
+        raise out[1]
+    return out[0]
+
+
+@contextmanager
+def _reader() -> Iterator[sqlite3.Connection]:
+    """Borrow a read connection from the pool.
+
+    ThreadingHTTPServer spawns a thread per request, so thread-local
+    connections would be reopened on every hit; a shared pool keeps them warm.
+    list.pop()/append() are atomic, no extra lock needed.
+    """
+    try:
+        conn = _read_pool.pop()
+    except IndexError:
+        conn = _get_db()
+    try:
+        yield conn
+    finally:
+        _read_pool.append(conn)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -137,37 +291,61 @@ def get_db() -> sqlite3.Connection:
 # ─────────────────────────────────────────────────────────────────────────────
 
 
-def list_chats() -> List[Dict[str, Any]]:
-    with _db_lock:
-        conn = get_db()
+# GET /v1/chats is polled by the UI far more often than chats change, so the
+# encoded list is cached and keyed by a version that every write visible in
+# the listing bumps (after its commit).
+_chats_version_counter = itertools.count(1)
+_chats_version = 0
+_chats_cache: Optional[Tuple[int, bytes]] = None
+
+# Empty-chat pruning needs a write, so it runs at most this often.
+_PRUNE_INTERVAL_SECONDS = 30.0
+_last_prune = 0.0
+
+
+def _bump_chats_version() -> None:
+    global _chats_version
+    _chats_version = next(_chats_version_counter)  # next() on count is atomic
 
-        # Auto-prune empty unnamed chats.
-        # Motivation: UI-driven session creation can leave behind empty drafts.
-        # Safety: keep the most recently updated chat even if empty (likely the current one).
-        grace_seconds = 120
-        try:
-            most_recent = conn.execute(
-                "SELECT id FROM chats ORDER BY updated_at DESC LIMIT 1"
-            ).fetchone()
-            keep_id = int(most_recent["id"]) if most_recent else -1
-            threshold = conn.execute(
-                "SELECT strftime('%s','now') - ? AS t", (grace_seconds,)
-            ).fetchone()["t"]
-            conn.execute(
-                """
-                DELETE FROM chats
-                 WHERE trim(name) = ''
-                   AND updated_at < ?
-                   AND id != ?
-                   AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.chat_id = chats.id)
-                """,
-                (threshold, keep_id),
-            )
-            conn.commit()
-        except Exception:
-            # Never fail listing due to cleanup.
-            pass
 
+def _prune_empty_chats() -> None:
+    # Auto-prune empty unnamed chats.
+    # Motivation: UI-driven session creation can leave behind empty drafts.
+    # Safety: keep the most recently updated chat even if empty (likely the current one).
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune < _PRUNE_INTERVAL_SECONDS:
+        return
+    _last_prune = now
+    grace_seconds = 120
+
+    def prune(conn: sqlite3.Connection) -> int:
+        most_recent = conn.execute(
+            "SELECT id FROM chats ORDER BY updated_at DESC LIMIT 1"
+        ).fetchone()
+        keep_id = int(most_recent["id"]) if most_recent else -1
+        threshold = time.time() - grace_seconds
+        return conn.execute(
+            """
+            DELETE FROM chats
+             WHERE trim(name) = ''
+               AND updated_at < ?
+               AND id != ?
+               AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.chat_id = chats.id)
+            """,
+            (threshold, keep_id),
+        ).rowcount
+
+    try:
+        if _write(prune) > 0:
+            _bump_chats_version()
+    except Exception:
+        # Never fail listing due to cleanup.
+        pass
+
+
+def _query_chats() -> List[Dict[str, Any]]:
+    with _reader() as conn:
         cur = conn.execute(
             """
             SELECT c.*, (
@@ -180,9 +358,27 @@ def list_chats() -> List[Dict[str, Any]]:
         return [dict(r) for r in cur.fetchall()]
 
 
+def list_chats() -> List[Dict[str, Any]]:
+    _prune_empty_chats()
+    return _query_chats()
+
+
+def list_chats_json() -> bytes:
+    """list_chats() encoded as JSON, served from cache while nothing changed."""
+    global _chats_cache
+    _prune_empty_chats()
+    version = _chats_version
+    cached = _chats_cache
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    payload = _json_bytes(_query_chats())
+    _chats_cache = (version, payload)
+    return payload
+
+
 def get_chat(chat_id: int) -> Optional[Dict[str, Any]]:
-    with _db_lock:
-        cur = get_db().execute(
+    with _reader() as conn:
+        cur = conn.execute(
             """
             SELECT c.*, (
                 SELECT COUNT(1) FROM messages m WHERE m.chat_id = c.id
@@ -197,61 +393,145 @@ def get_chat(chat_id: int) -> Optional[Dict[str, Any]]:
 
 
 def create_chat(name: str = "") -> Dict[str, Any]:
-    with _db_lock:
-        conn = get_db()
-        cur = conn.execute("INSERT INTO chats (name) VALUES (?)", (name,))
-        conn.commit()
-        chat_id = cur.lastrowid
+    chat_id = _write(
+        lambda conn: conn.execute("INSERT INTO chats (name) VALUES (?)", (name,)).lastrowid
+    )
+    _bump_chats_version()
     return get_chat(chat_id) or {"id": chat_id, "name": name}
 
 
 def update_chat(chat_id: int, name: str) -> Optional[Dict[str, Any]]:
-    with _db_lock:
-        conn = get_db()
-        conn.execute(
-            "UPDATE chats SET name = ?, updated_at = strftime('%s', 'now') WHERE id = ?",
-            (name, chat_id)
-        )
-        conn.commit()
+    _write(lambda conn: conn.execute(
+        "UPDATE chats SET name = ?, updated_at = ? WHERE id = ?",
+        (name, time.time(), chat_id)
+    ))
+    _bump_chats_version()
     return get_chat(chat_id)
 
 
 def delete_chat(chat_id: int) -> bool:
-    with _db_lock:
-        conn = get_db()
-        cur = conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
-        conn.commit()
-        return cur.rowcount > 0
+    deleted = _write(
+        lambda conn: conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,)).rowcount > 0
+    )
+    _bump_chats_version()
+    return deleted
 
 
 def clear_chat(chat_id: int) -> bool:
-    with _db_lock:
-        conn = get_db()
-        conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
-        conn.commit()
-        return True
-
-
-def get_messages(chat_id: int) -> List[Dict[str, Any]]:
-    with _db_lock:
-        cur = get_db().execute(
-            "SELECT * FROM messages WHERE chat_id = ? ORDER BY id ASC",
-            (chat_id,)
-        )
-        rows = cur.fetchall()
-    result = []
-    for r in rows:
-        msg = dict(r)
-        for field in ("annotations", "annotation_sources", "function_call", "tool_calls"):
-            if msg.get(field):
-                try:
-                    msg[field] = json.loads(msg[field])
-                except Exception:
-                    pass
-        msg["thinking"] = bool(msg.get("thinking"))
-        msg["done"] = bool(msg.get("done", True))
-        result.append(msg)
-    return result
+    _write(lambda conn: conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,)))
+    _bump_chats_version()
+    return True
+
+
+_SELECT_MESSAGES_SQL = """
+    SELECT m.id, m.chat_id, m.role, m.content, m.raw_content, m.model, m.thinking, m.done,
+           COALESCE(t.function_name, '') AS function_name,
+           COALESCE(t.function_call, '') AS function_call,
+           COALESCE(t.function_response, '') AS function_response,
+           COALESCE(t.tool_calls, '[]') AS tool_calls,
+           m.usage_prompt_tokens, m.usage_completion_tokens, m.usage_total_tokens, m.usage_estimated,
+           m.annotations, m.annotation_sources, m.created_at
+      FROM messages m
+      LEFT JOIN message_tool_calls t ON t.message_id = m.id
+     WHERE m.chat_id = ?
+  ORDER BY m.id ASC
+"""
+
+
+# TEXT columns holding JSON. Most rows store '' or '[]' here, which are
+# mapped directly instead of going through the decoder.
+_JSON_COLUMNS = ("annotations", "annotation_sources", "function_call", "tool_calls")
+_BOOL_COLUMNS = ("thinking", "done")
+
+
+def _decode_json_column(v: str) -> Any:
+    if v == "[]":
+        return []
+    try:
+        return _loads(v)
+    except Exception:
+        return v
+
+
+@functools.lru_cache(maxsize=None)
+def _row_to_message_fn(columns: Tuple[str, ...], decode: bool) -> Callable[[tuple], Dict[str, Any]]:
+    """Build a function turning a raw message row into its dict.
+
+    The column layout is fixed per query, so the conversion is generated once
+    as straight-line tuple indexing instead of building a sqlite3.Row and
+    casting it to a dict for every row.
+    """
+    fields = []
+    for i, name in enumerate(columns):
+        if name in _BOOL_COLUMNS:
+            expr = f"bool(t[{i}])"
+        elif decode and name in _JSON_COLUMNS:
+            expr = f"_decode(t[{i}]) if t[{i}] else t[{i}]"
+        else:
+            expr = f"t[{i}]"
+        fields.append(f"{name!r}: {expr}")
+    src = "def row_to_message(t):\n    return {" + ", ".join(fields) + "}\n"
+    namespace: Dict[str, Any] = {"_decode": _decode_json_column}
+    exec(src, namespace)
+    return namespace["row_to_message"]
+
+
+def iter_messages(chat_id: int, decode: bool = True) -> Iterator[Dict[str, Any]]:
+    """Yield the messages of a chat, oldest first, a batch of rows at a time.
+
+    With decode=False the JSON columns are returned as the stored strings,
+    for callers that only need the text. A read connection stays borrowed
+    until the iterator is exhausted or closed.
+    """
+    with _reader() as conn:
+        cur = conn.cursor()
+        cur.row_factory = None
+        cur.execute(_SELECT_MESSAGES_SQL, (chat_id,))
+        row_to_message = _row_to_message_fn(tuple(d[0] for d in cur.description), decode)
+        while True:
+            rows = cur.fetchmany(256)
+            if not rows:
+                break
+            for r in rows:
+                yield row_to_message(r)
+
+
+def get_messages(chat_id: int, decode: bool = True) -> List[Dict[str, Any]]:
+    return list(iter_messages(chat_id, decode))
+
+
+_INSERT_MESSAGE_SQL = """
+    INSERT INTO messages
+           (chat_id, role, content, raw_content, model, thinking, done,
+            usage_prompt_tokens, usage_completion_tokens, usage_total_tokens, usage_estimated,
+            annotations, annotation_sources, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_INSERT_TOOL_CALLS_SQL = """
+    INSERT INTO message_tool_calls
+           (message_id, function_name, function_call, function_response, tool_calls)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def _maybe_json(v: Any, default: str) -> Any:
+    """Encode list/dict values for a JSON TEXT column; None becomes default."""
+    if v is None:
+        return default
+    if isinstance(v, (list, dict)):
+        return _dumps(v).decode("utf-8")
+    return v
+
+
+def _to_int_or_none(v: Any) -> Optional[int]:
+    try:
+        if v is None:
+            return None
+        iv = int(v)
+        return iv if iv >= 0 else None
+    except Exception:
+        return None
 
 
 def add_message(chat_id: int, msg: Dict[str, Any]) -> Dict[str, Any]:
@@ -286,52 +566,30 @@ def add_message(chat_id: int, msg: Dict[str, Any]) -> Dict[str, Any]:
         usage_estimated = usage.get("estimated", False)
     usage_estimated_i = 1 if bool(usage_estimated) else 0
 
-    def _to_int_or_none(v: Any) -> Optional[int]:
-        try:
-            if v is None:
-                return None
-            iv = int(v)
-            return iv if iv >= 0 else None
-        except Exception:
-            return None
-
     usage_prompt_tokens = _to_int_or_none(usage_prompt_tokens)
     usage_completion_tokens = _to_int_or_none(usage_completion_tokens)
     usage_total_tokens = _to_int_or_none(usage_total_tokens)
 
-    if isinstance(function_call, dict):
-        function_call = json.dumps(function_call, ensure_ascii=False)
-    elif function_call is None:
-        function_call = ""
-    if isinstance(annotations, list):
-        annotations = json.dumps(annotations, ensure_ascii=False)
-    if isinstance(annotation_sources, list):
-        annotation_sources = json.dumps(annotation_sources, ensure_ascii=False)
-    if isinstance(tool_calls, (list, dict)):
-        tool_calls = json.dumps(tool_calls, ensure_ascii=False)
-    elif tool_calls is None:
-        tool_calls = "[]"
-
-    with _db_lock:
-        conn = get_db()
-        cur = conn.execute(
-            """INSERT INTO messages 
-                    (chat_id, role, content, raw_content, model, thinking, done, 
-                     function_name, function_call, function_response, tool_calls,
-                     usage_prompt_tokens, usage_completion_tokens, usage_total_tokens, usage_estimated,
-                     annotations, annotation_sources)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (chat_id, role, content, raw_content, model, thinking, done,
-                 function_name, function_call, function_response, tool_calls,
-                 usage_prompt_tokens, usage_completion_tokens, usage_total_tokens, usage_estimated_i,
-                 annotations, annotation_sources)
-        )
-        conn.execute(
-            "UPDATE chats SET updated_at = strftime('%s', 'now') WHERE id = ?",
-            (chat_id,)
-        )
-        conn.commit()
-        msg_id = cur.lastrowid
+    params = (
+        chat_id, role, content, raw_content, model, thinking, done,
+        usage_prompt_tokens, usage_completion_tokens, usage_total_tokens, usage_estimated_i,
+        _maybe_json(annotations, "[]"), _maybe_json(annotation_sources, "[]"),
+        time.time(),
+    )
+    tool_params = (
+        function_name or "", _maybe_json(function_call, ""), function_response or "",
+        _maybe_json(tool_calls, "[]"),
+    )
+    has_tool_data = tool_params != ("", "", "", "[]")
+
+    def insert(conn: sqlite3.Connection) -> int:
+        msg_id = conn.execute(_INSERT_MESSAGE_SQL, params).lastrowid
+        if has_tool_data:
+            conn.execute(_INSERT_TOOL_CALLS_SQL, (msg_id, *tool_params))
+        return msg_id
+
+    msg_id = _write(insert)
+    _bump_chats_version()
 
     return {
         "id": msg_id,
@@ -345,36 +603,41 @@ def add_message(chat_id: int, msg: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+# Columns update_message may touch, in the order they appear in the SET clause.
+_MESSAGE_UPDATE_COLUMNS = ("content", "raw_content", "done", "thinking")
+
+
+@functools.lru_cache(maxsize=None)
+def _update_message_sql(columns: Tuple[str, ...]) -> str:
+    # At most 2**4 shapes, so every UPDATE string is built once and the
+    # statement cache sees the same object each time.
+    return f"UPDATE messages SET {', '.join(c + ' = ?' for c in columns)} WHERE id = ?"
+
+
 def update_message(msg_id: int, updates: Dict[str, Any]) -> bool:
-    fields = []
-    values = []
+    by_column: Dict[str, Any] = {}
     for k, v in updates.items():
         key = "raw_content" if k == "rawContent" else k
         if key in ("content", "raw_content"):
-            fields.append(f"{key} = ?")
-            values.append(v)
-        elif key == "done":
-            fields.append("done = ?")
-            values.append(1 if v else 0)
-        elif key == "thinking":
-            fields.append("thinking = ?")
-            values.append(1 if v else 0)
-    if not fields:
+            by_column[key] = v
+        elif key in ("done", "thinking"):
+            by_column[key] = 1 if v else 0
+    if not by_column:
         return False
+    columns = tuple(c for c in _MESSAGE_UPDATE_COLUMNS if c in by_column)
+    values = [by_column[c] for c in columns]
     values.append(msg_id)
-    with _db_lock:
-        conn = get_db()
-        conn.execute(f"UPDATE messages SET {', '.join(fields)} WHERE id = ?", values)
-        conn.commit()
+    sql = _update_message_sql(columns)
+    _write(lambda conn: conn.execute(sql, values))
     return True
 
 
 def delete_message(msg_id: int) -> bool:
-    with _db_lock:
-        conn = get_db()
-        cur = conn.execute("DELETE FROM messages WHERE id = ?", (msg_id,))
-        conn.commit()
-        return cur.rowcount > 0
+    deleted = _write(
+        lambda conn: conn.execute("DELETE FROM messages WHERE id = ?", (msg_id,)).rowcount > 0
+    )
+    _bump_chats_version()
+    return deleted
 
 
 def get_or_create_current_chat() -> Dict[str, Any]:
@@ -395,16 +658,37 @@ def _env(name: str, default: str = "") -> str:
 
 
 def _json_bytes(obj: Any) -> bytes:
-    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return _dumps(obj)
+
+
+# Largest request body we accept. Chat payloads are far smaller; anything
+# bigger is rejected before a buffer is allocated for it.
+MAX_BODY = 2 * 1024 * 1024
 
 
 def _read_json(handler: BaseHTTPRequestHandler) -> Any:
     length = int(handler.headers.get("Content-Length", "0") or "0")
-    raw = handler.rfile.read(length) if length > 0 else b"{}"
+    if length <= 0:
+        return {}
+    if length > MAX_BODY:
+        raise ValueError("Body too large")
+    # Read straight into one preallocated buffer; both decoders accept a
+    # bytearray, so the body is never copied or transcoded to str.
+    raw = bytearray(length)
+    view = memoryview(raw)
+    n = 0
+    while n < length:
+        got = handler.rfile.readinto(view[n:])
+        if not got:
+            break
+        n += got
+    view.release()
+    if n < length:
+        del raw[n:]
     if not raw:
         return {}
     try:
-        return json.loads(raw.decode("utf-8"))
+        return _loads(raw)
     except Exception:
         raise ValueError("Invalid JSON")
 
@@ -425,6 +709,10 @@ def _join_url(base: str, path: str) -> str:
 # ─────────────────────────────────────────────────────────────────────────────
 
 
+# /v1/<resource>[/<id>], with an optional trailing slash.
+_PATH_RE = re.compile(r"^/v1/(chat/completions|\w+)(?:/(\d+))?/?$")
+
+
 class Handler(BaseHTTPRequestHandler):
     server_version = "ii-ai-backend/0.2"
 
@@ -432,168 +720,225 @@ class Handler(BaseHTTPRequestHandler):
         return
 
     def _send_json(self, code: int, obj: Any) -> None:
-        payload = _json_bytes(obj)
+        self._send_json_bytes(code, _json_bytes(obj))
+
+    def _send_json_bytes(self, code: int, payload: bytes) -> None:
         self.send_response(code)
         self.send_header("Content-Type", "application/json; charset=utf-8")
         self.send_header("Content-Length", str(len(payload)))
         self.end_headers()
         self.wfile.write(payload)
 
+    def _send_json_array_stream(self, code: int, items: Iterator[Any]) -> None:
+        """Send a JSON array encoded item by item.
+
+        The server speaks HTTP/1.0, so instead of chunked encoding the body is
+        delimited by closing the connection. Output is written in ~64 KiB
+        batches, so neither the full item list nor the full payload is held
+        in memory.
+        """
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        buf = bytearray(b"[")
+        first = True
+        for item in items:
+            if not first:
+                buf += b","
+            first = False
+            buf += _json_bytes(item)
+            if len(buf) >= 65536:
+                self.wfile.write(buf)
+                buf.clear()
+        buf += b"]"
+        self.wfile.write(buf)
+
     def _send_error_json(self, code: int, message: str) -> None:
         self._send_json(code, {"error": {"message": message}})
 
     def _parse_path(self) -> tuple:
-        path = self.path.rstrip("/")
-        # Handle /v1/chat/completions specially
-        if path == "/v1/chat/completions":
-            return "chat/completions", None
-        m = re.match(r"^/v1/(\w+)/(\d+)$", path)
-        if m:
-            return m.group(1), int(m.group(2))
-        m = re.match(r"^/v1/(\w+)$", path)
-        if m:
-            return m.group(1), None
-        return "", None
+        path, _, self._query = self.path.partition("?")
+        m = _PATH_RE.match(path)
+        if not m:
+            return "", None
+        resource, rid = m.groups()
+        return resource, int(rid) if rid else None
 
-    def do_GET(self) -> None:
-        resource, rid = self._parse_path()
+    # ── GET ──────────────────────────────────────────────────────────────────
 
-        if resource == "health":
-            client = self.server.upstream
-            self._send_json(200, client.health())
-            return
+    def _get_health(self, rid: Optional[int]) -> None:
+        client = self.server.upstream
+        self._send_json(200, client.health())
 
-        if resource == "chats":
-            if rid is not None:
-                chat = get_chat(rid)
-                if chat:
-                    self._send_json(200, chat)
-                else:
-                    self._send_error_json(404, "Chat not found")
+    def _get_chats(self, rid: Optional[int]) -> None:
+        if rid is not None:
+            chat = get_chat(rid)
+            if chat:
+                self._send_json(200, chat)
             else:
-                self._send_json(200, list_chats())
-            return
+                self._send_error_json(404, "Chat not found")
+        else:
+            self._send_json_bytes(200, list_chats_json())
 
-        if resource == "messages":
-            if rid is not None:
-                self._send_json(200, get_messages(rid))
-            else:
-                self._send_error_json(400, "Chat ID required")
-            return
+    def _get_messages(self, rid: Optional[int]) -> None:
+        if rid is not None:
+            # ?decode=0 skips decoding the JSON columns.
+            decode = parse_qs(self._query).get("decode", ["1"])[-1] != "0"
+            self._send_json_array_stream(200, iter_messages(rid, decode=decode))
+        else:
+            self._send_error_json(400, "Chat ID required")
 
-        if resource == "current":
-            chat = get_or_create_current_chat()
-            chat["messages"] = get_messages(chat["id"])
-            self._send_json(200, chat)
-            return
+    def _get_current(self, rid: Optional[int]) -> None:
+        chat = get_or_create_current_chat()
+        chat["messages"] = get_messages(chat["id"])
+        self._send_json(200, chat)
 
-        if resource == "tools":
-            # GET /v1/tools returns tool definitions
-            self._send_json(200, {"tools": get_tool_definitions()})
-            return
+    def _get_tools(self, rid: Optional[int]) -> None:
+        # GET /v1/tools returns tool definitions
+        self._send_json(200, {"tools": get_tool_definitions()})
 
-        self._send_error_json(404, "Not found")
+    # ── POST ─────────────────────────────────────────────────────────────────
 
-    def do_POST(self) -> None:
-        resource, rid = self._parse_path()
+    def _post_chats(self, rid: Optional[int], body: Dict[str, Any]) -> None:
+        if rid is None:
+            name = body.get("name", "")
+            chat = create_chat(name)
+            self._send_json(201, chat)
+        else:
+            self._send_error_json(400, "Use PUT to update")
 
-        if resource == "chat/completions":
-            self._handle_chat_completions()
-            return
+    def _post_messages(self, rid: Optional[int], body: Dict[str, Any]) -> None:
+        if rid is not None:
+            msg = add_message(rid, body)
+            self._send_json(201, msg)
+        else:
+            self._send_error_json(400, "Chat ID required")
 
-        try:
-            body = _read_json(self)
-            if not isinstance(body, dict):
-                body = {}
-        except ValueError as e:
-            self._send_error_json(400, str(e))
+    def _post_clear(self, rid: Optional[int], body: Dict[str, Any]) -> None:
+        if rid is not None:
+            clear_chat(rid)
+            self._send_json(200, {"ok": True})
+        else:
+            self._send_error_json(400, "Chat ID required")
+
+    def _post_tools(self, rid: Optional[int], body: Dict[str, Any]) -> None:
+        # Execute a tool: POST /v1/tools with body {"name": "...", "args": {...}}
+        tool_name = body.get("name", "")
+        tool_args = body.get("args", {})
+        if not tool_name:
+            self._send_error_json(400, "Tool name required")
             return
+        result = execute_tool(tool_name, tool_args)
+        self._send_json(200, result)
 
-        if resource == "chats":
-            if rid is None:
-                name = body.get("name", "")
-                chat = create_chat(name)
-                self._send_json(201, chat)
-            else:
-                self._send_error_json(400, "Use PUT to update")
-            return
+    # ── PUT ──────────────────────────────────────────────────────────────────
 
-        if resource == "messages":
-            if rid is not None:
-                msg = add_message(rid, body)
-                self._send_json(201, msg)
-            else:
-                self._send_error_json(400, "Chat ID required")
-            return
+    def _put_chats(self, rid: int, body: Dict[str, Any]) -> None:
+        name = body.get("name", "")
+        chat = update_chat(rid, name)
+        if chat:
+            self._send_json(200, chat)
+        else:
+            self._send_error_json(404, "Chat not found")
 
-        if resource == "clear":
-            if rid is not None:
-                clear_chat(rid)
-                self._send_json(200, {"ok": True})
-            else:
-                self._send_error_json(400, "Chat ID required")
-            return
+    def _put_messages(self, rid: int, body: Dict[str, Any]) -> None:
+        if update_message(rid, body):
+            self._send_json(200, {"ok": True})
+        else:
+            self._send_error_json(404, "Message not found")
 
-        if resource == "tools":
-            # Execute a tool: POST /v1/tools with body {"name": "...", "args": {...}}
-            tool_name = body.get("name", "")
-            tool_args = body.get("args", {})
-            if not tool_name:
-                self._send_error_json(400, "Tool name required")
-                return
-            result = execute_tool(tool_name, tool_args)
-            self._send_json(200, result)
-            return
+    # ── DELETE ───────────────────────────────────────────────────────────────
 
-        self._send_error_json(404, "Not found")
+    def _delete_chats(self, rid: int) -> None:
+        if delete_chat(rid):
+            self._send_json(200, {"ok": True})
+        else:
+            self._send_error_json(404, "Chat not found")
 
-    def do_PUT(self) -> None:
-        resource, rid = self._parse_path()
+    def _delete_messages(self, rid: int) -> None:
+        if delete_message(rid):
+            self._send_json(200, {"ok": True})
+        else:
+            self._send_error_json(404, "Message not found")
+
+    # Route tables: resource -> handler. PUT/DELETE routes require an id.
+    _GET_ROUTES = {
+        "health": _get_health,
+        "chats": _get_chats,
+        "messages": _get_messages,
+        "current": _get_current,
+        "tools": _get_tools,
+    }
+    _POST_ROUTES = {
+        "chats": _post_chats,
+        "messages": _post_messages,
+        "clear": _post_clear,
+        "tools": _post_tools,
+    }
+    _PUT_ROUTES = {
+        "chats": _put_chats,
+        "messages": _put_messages,
+    }
+    _DELETE_ROUTES = {
+        "chats": _delete_chats,
+        "messages": _delete_messages,
+    }
 
+    def _read_body(self) -> Optional[Dict[str, Any]]:
         try:
             body = _read_json(self)
-            if not isinstance(body, dict):
-                body = {}
         except ValueError as e:
             self._send_error_json(400, str(e))
+            return None
+        return body if isinstance(body, dict) else {}
+
+    def do_GET(self) -> None:
+        resource, rid = self._parse_path()
+        route = self._GET_ROUTES.get(resource)
+        if route is None:
+            self._send_error_json(404, "Not found")
             return
+        route(self, rid)
 
-        if resource == "chats" and rid is not None:
-            name = body.get("name", "")
-            chat = update_chat(rid, name)
-            if chat:
-                self._send_json(200, chat)
-            else:
-                self._send_error_json(404, "Chat not found")
+    def do_POST(self) -> None:
+        resource, rid = self._parse_path()
+
+        if resource == "chat/completions":
+            self._handle_chat_completions()
             return
 
-        if resource == "messages" and rid is not None:
-            if update_message(rid, body):
-                self._send_json(200, {"ok": True})
-            else:
-                self._send_error_json(404, "Message not found")
+        body = self._read_body()
+        if body is None:
             return
 
-        self._send_error_json(404, "Not found")
+        route = self._POST_ROUTES.get(resource)
+        if route is None:
+            self._send_error_json(404, "Not found")
+            return
+        route(self, rid, body)
 
-    def do_DELETE(self) -> None:
+    def do_PUT(self) -> None:
         resource, rid = self._parse_path()
 
-        if resource == "chats" and rid is not None:
-            if delete_chat(rid):
-                self._send_json(200, {"ok": True})
-            else:
-                self._send_error_json(404, "Chat not found")
+        body = self._read_body()
+        if body is None:
             return
 
-        if resource == "messages" and rid is not None:
-            if delete_message(rid):
-                self._send_json(200, {"ok": True})
-            else:
-                self._send_error_json(404, "Message not found")
+        route = self._PUT_ROUTES.get(resource)
+        if route is None or rid is None:
+            self._send_error_json(404, "Not found")
             return
+        route(self, rid, body)
 
-        self._send_error_json(404, "Not found")
+    def do_DELETE(self) -> None:
+        resource, rid = self._parse_path()
+        route = self._DELETE_ROUTES.get(resource)
+        if route is None or rid is None:
+            self._send_error_json(404, "Not found")
+            return
+        route(self, rid)
 
     def _handle_chat_completions(self) -> None:
         """Handle /v1/chat/completions with automatic tool injection and execution."""
@@ -635,7 +980,7 @@ class Handler(BaseHTTPRequestHandler):
             if "error" in response_data:
                 self._send_error_json(502, response_data["error"].get("message", "Unknown error"))
             else:
-                raw = json.dumps(response_data, ensure_ascii=False).encode("utf-8")
+                raw = _json_bytes(response_data)
                 self.send_response(200)
                 self.send_header("Content-Type", "application/json; charset=utf-8")
                 self.send_header("Content-Length", str(len(raw)))
@@ -651,7 +996,7 @@ def main(argv: list) -> int:
     except ValueError:
         port = 15333
 
-    get_db()
+    open_db()
 
     server = ThreadingHTTPServer((host, port), Handler)
     server.upstream = UpstreamClient()
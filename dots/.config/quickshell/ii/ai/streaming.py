@@ -4,14 +4,131 @@ from __future__ import annotations
 
 import json
 import os
+import re
 import sys
 import time
-from typing import Any, Callable, Dict, List, Optional, BinaryIO
+from typing import Any, Callable, Dict, Iterator, List, Optional, BinaryIO
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib path produces the same JSON
+    orjson = None
 
 from .tools import execute_tool, get_tool_definitions
 from .upstream import UpstreamClient, ProxyError
 
 
+if orjson is not None:
+    _dumps = orjson.dumps
+else:
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# Running usage estimates are the most frequent event we emit; format them
+# from a template instead of building and encoding a dict each time.
+_USAGE_ESTIMATE_FRAME = (
+    b'data: {"type":"usage","usage":{"prompt_tokens":%d,"completion_tokens":%d,'
+    b'"total_tokens":%d},"estimated":true,"request_id":"%s"}\n\n'
+)
+
+# Most upstream frames only carry a content delta. For those the text is
+# pulled out of the raw bytes and only the string literal is decoded; frames
+# mentioning any of _FULL_PARSE_KEYS go through json.loads.
+# _DELTA_CONTENT_RE only takes a "content" key sitting directly in the delta
+# object (no nested object before it), never e.g. one under "logprobs". A
+# frame with a string "content" it can't place is fully parsed instead.
+_DELTA_CONTENT_RE = re.compile(rb'"delta"\s*:\s*\{[^{}]*?"content"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_CONTENT_RE = re.compile(rb'"content"\s*:\s*"')
+_FULL_PARSE_KEYS = (b'"tool_calls"', b'"usage"', b'"reasoning_content"')
+
+
+def _parse_env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, "") or default)
+    except ValueError:
+        return default
+
+
+# Allow override via env for long agent/tool chains. Read once at import;
+# 0 keeps the per-call max_iterations.
+_MAX_ITER_OVERRIDE = _parse_env_int("II_AI_MAX_TOOL_ITERATIONS", 0)
+
+
+# Events the client acts on right away (tool progress, usage, turn
+# boundaries); these are flushed as soon as they are written.
+_FORCE_FLUSH_EVENTS = frozenset({"tool_execution", "tool_result", "usage", "continuation"})
+
+
+def _iter_lines(
+    resp: Any,
+    size: int = 65536,
+    before_read: Optional[Callable[[], Any]] = None,
+) -> Iterator[bytes]:
+    """
+    Yield the lines of an upstream response, newline included.
+    Reads whatever has arrived (up to `size` bytes) per call, so a burst of
+    SSE frames costs one read instead of a readline() per line.
+    `before_read` is called before every read that may block, once the lines
+    already received have all been yielded.
+    """
+    read1 = getattr(resp, "read1", None)
+    if read1 is None:
+        while True:
+            if before_read is not None:
+                before_read()
+            line = resp.readline()
+            if not line:
+                return
+            yield line
+    pending = b""
+    while True:
+        if before_read is not None:
+            before_read()
+        chunk = read1(size)
+        if not chunk:
+            break
+        buf = pending + chunk if pending else chunk
+        start = 0
+        while True:
+            end = buf.find(b"\n", start) + 1
+            if not end:
+                break
+            yield buf[start:end]
+            start = end
+        pending = buf[start:]
+    if pending:
+        yield pending
+
+
+class BufferedSSEWriter:
+    """
+    Coalesces small writes to the client into fewer socket writes.
+    Data is held until the buffer reaches `limit` bytes, `interval` seconds
+    have passed since the last flush, or a write asks for a flush. Upstream
+    sends one tiny frame per token, so this batches a few tokens per send.
+    """
+
+    def __init__(self, wfile: BinaryIO, limit: int = 16384, interval: float = 0.05):
+        self.wfile = wfile
+        self.limit = limit
+        self.interval = interval
+        self._buf = bytearray()
+        self._last_flush = 0.0
+
+    def write(self, data: bytes, force: bool = False) -> None:
+        self._buf += data
+        if force or len(self._buf) >= self.limit or time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buf:
+            self.wfile.write(self._buf)
+            self._buf.clear()
+        self.wfile.flush()
+        self._last_flush = time.monotonic()
+
+
 class StreamHandler:
     """
     Handles streaming responses with automatic tool execution.
@@ -25,22 +142,30 @@ class StreamHandler:
         send_headers: Optional[Callable[[], None]] = None
     ):
         self.wfile = wfile
+        self._out = BufferedSSEWriter(wfile)
         self.client = client
         self.send_headers = send_headers
         self._headers_sent = False
     
-    def _write(self, data: bytes) -> bool:
+    def _write(self, data: bytes, force: bool = False) -> bool:
         """Write data to client. Returns False if connection is broken."""
         try:
-            self.wfile.write(data)
-            self.wfile.flush()
+            self._out.write(data, force)
+            return True
+        except (BrokenPipeError, ConnectionResetError):
+            return False
+
+    def _flush(self) -> bool:
+        """Push any buffered bytes to the client."""
+        try:
+            self._out.flush()
             return True
         except (BrokenPipeError, ConnectionResetError):
             return False
     
     def _send_event(self, event: Dict[str, Any]) -> bool:
         """Send a JSON event to the client."""
-        return self._write(f"data: {json.dumps(event)}\n\n".encode())
+        return self._write(b"data: " + _dumps(event) + b"\n\n", event.get("type") in _FORCE_FLUSH_EVENTS)
     
     def _send_error(self, message: str) -> bool:
         """Send an error event to the client."""
@@ -53,9 +178,36 @@ class StreamHandler:
         We intentionally keep this stdlib-only. For UI/telemetry it's better than nothing.
         Approximation: ~4 chars per token.
         """
-        if not text:
+        return StreamHandler._estimate_tokens_from_chars(len(text) if text else 0)
+
+    @staticmethod
+    def _estimate_tokens_from_chars(chars: int) -> int:
+        """Same estimate as _estimate_tokens, from a character count."""
+        if chars <= 0:
             return 0
-        return max(1, (len(text) + 3) // 4)
+        return max(1, (chars + 3) // 4)
+
+    @staticmethod
+    def _estimate_prompt_tokens(messages: Any) -> int:
+        """Estimate prompt tokens by walking the messages instead of serializing them.
+
+        Counts content, reasoning_content and tool call names/arguments, plus
+        a small per-message allowance for the role and framing.
+        """
+        chars = 0
+        for m in messages or ():
+            if not isinstance(m, dict):
+                continue
+            for field in ("content", "reasoning_content"):
+                v = m.get(field)
+                if v:
+                    chars += len(v) if isinstance(v, str) else len(str(v))
+            for tc in m.get("tool_calls") or ():
+                func = tc.get("function") if isinstance(tc, dict) else None
+                if isinstance(func, dict):
+                    chars += len(str(func.get("name") or "")) + len(str(func.get("arguments") or ""))
+            chars += 16
+        return StreamHandler._estimate_tokens_from_chars(chars)
     
     def handle_streaming(
         self,
@@ -66,38 +218,42 @@ class StreamHandler:
         """
         Handle streaming response with automatic tool execution.
         
-        Recursively continues the conversation if model uses tools.
+        Runs one upstream round per loop iteration, continuing the
+        conversation while the model calls tools.
         """
-        # Allow override via env for long agent/tool chains.
-        try:
-            env_max = int(os.environ.get("II_AI_MAX_TOOL_ITERATIONS", "") or "0")
-            if env_max > 0:
-                max_iterations = env_max
-        except Exception:
-            pass
-
-        if max_iterations <= 0:
-            # Best-effort usage even on early abort so UI can show ctx/token.
-            try:
-                prompt_text = json.dumps(body.get("messages", []), ensure_ascii=False)
-            except Exception:
-                prompt_text = ""
-            prompt_tokens = self._estimate_tokens(prompt_text)
-            self._send_event({
-                "type": "usage",
-                "usage": {
-                    "prompt_tokens": prompt_tokens,
-                    "completion_tokens": 0,
-                    "total_tokens": prompt_tokens,
-                },
-                "estimated": True,
-            })
+        if _MAX_ITER_OVERRIDE > 0:
+            max_iterations = _MAX_ITER_OVERRIDE
+
+        while max_iterations > 0:
+            if not self._stream_round(body, is_first, max_iterations):
+                return
+            is_first = False
+            max_iterations -= 1
+
+        # Best-effort usage even on early abort so UI can show ctx/token.
+        prompt_tokens = self._estimate_prompt_tokens(body.get("messages"))
+        self._send_event({
+            "type": "usage",
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": 0,
+                "total_tokens": prompt_tokens,
+            },
+            "estimated": True,
+        })
+
+        self._send_error("Max tool iterations reached (II_AI_MAX_TOOL_ITERATIONS)")
+        self._write(b"data: [DONE]\n\n", force=True)
 
-            self._send_error("Max tool iterations reached (II_AI_MAX_TOOL_ITERATIONS)")
-            self._write(b"data: [DONE]\n\n")
-            return
+    def _stream_round(self, body: Dict[str, Any], is_first: bool, max_iterations: int) -> bool:
+        """
+        Stream one upstream request to the client.
 
+        Returns True if the model called tools and their results were
+        appended to body["messages"], i.e. another round is needed.
+        """
         request_id = hex(int(time.time() * 1000))[2:]
+        request_id_bytes = request_id.encode("ascii")
         
         # Send headers on first call
         if is_first and self.send_headers and not self._headers_sent:
@@ -113,11 +269,7 @@ class StreamHandler:
             resp = self.client.request_chat_completions(body)
         except ProxyError as e:
             # Best-effort usage even on upstream failure.
-            try:
-                prompt_text = json.dumps(body.get("messages", []), ensure_ascii=False)
-            except Exception:
-                prompt_text = ""
-            prompt_tokens = self._estimate_tokens(prompt_text)
+            prompt_tokens = self._estimate_prompt_tokens(body.get("messages"))
             self._send_event({
                 "type": "usage",
                 "usage": {
@@ -130,23 +282,24 @@ class StreamHandler:
             })
 
             self._send_error(str(e))
-            self._write(b"data: [DONE]\n\n")
-            return
+            self._write(b"data: [DONE]\n\n", force=True)
+            return False
         
         # Buffer for accumulating tool call data
         tool_call_buffer: Dict[str, Dict[str, Any]] = {}
-        collected_content = ""
-        collected_reasoning = ""
+        # Deltas are collected as fragments and only joined if the assistant
+        # message has to be rebuilt for a tool follow-up.
+        content_parts: List[str] = []
+        reasoning_parts: List[str] = []
+        # Running length of the collected reasoning + content, so the
+        # estimate doesn't have to join the fragments on every delta.
+        completion_chars = 0
         collected_tool_calls: List[Dict[str, Any]] = []
         last_usage: Optional[Dict[str, Any]] = None
 
         # For real-time ctx/token display, send periodic best-effort usage estimates
         # while streaming (throttled to avoid spamming the UI).
-        try:
-            _prompt_text_for_estimate = json.dumps(body.get("messages", []), ensure_ascii=False)
-        except Exception:
-            _prompt_text_for_estimate = ""
-        _prompt_tokens_estimate = self._estimate_tokens(_prompt_text_for_estimate)
+        _prompt_tokens_estimate = self._estimate_prompt_tokens(body.get("messages"))
         _last_usage_emit_ts = 0.0
 
         def _maybe_emit_usage_estimate(force: bool = False) -> None:
@@ -154,44 +307,38 @@ class StreamHandler:
             if last_usage is not None:
                 # Upstream already provides usage; don't emit estimates anymore.
                 return
-            now = time.time()
+            now = time.monotonic()
             if not force and (now - _last_usage_emit_ts) < 0.75:
                 return
-            completion_text = (collected_reasoning or "") + (collected_content or "")
-            completion_tokens = self._estimate_tokens(completion_text)
-            self._send_event({
-                "type": "usage",
-                "usage": {
-                    "prompt_tokens": _prompt_tokens_estimate,
-                    "completion_tokens": completion_tokens,
-                    "total_tokens": _prompt_tokens_estimate + completion_tokens,
-                },
-                "estimated": True,
-                "request_id": request_id,
-            })
+            completion_tokens = self._estimate_tokens_from_chars(completion_chars)
+            frame = _USAGE_ESTIMATE_FRAME % (
+                _prompt_tokens_estimate,
+                completion_tokens,
+                _prompt_tokens_estimate + completion_tokens,
+                request_id_bytes,
+            )
+            self._write(frame, force=True)
             _last_usage_emit_ts = now
         
         try:
-            while True:
-                line = resp.readline()
-                if not line:
-                    break
-                
-                line_str = line.decode("utf-8") if isinstance(line, bytes) else line
-                
+            # Lines stay bytes throughout: they are parsed and forwarded as-is.
+            # Whatever the last burst produced goes out before waiting on
+            # upstream again; a pause there must not hold back text.
+            for line in _iter_lines(resp, before_read=self._flush):
                 # Parse SSE data
-                if line_str.strip().startswith("data:"):
-                    data_str = line_str.strip()[5:].strip()
-                    if data_str == "[DONE]":
+                if line.startswith(b"data:"):
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
                         # Check if we need to handle tool calls
                         if tool_call_buffer:
-                            # Execute all tools and collect results
-                            tool_results: Dict[str, Dict[str, Any]] = {}
+                            # Execute all tools, collecting the tool messages for the follow-up
+                            tool_reply_msgs: List[Dict[str, Any]] = []
                             
                             for key, buf in tool_call_buffer.items():
                                 if buf.get("name"):
+                                    args_str = "".join(buf["args_parts"])
                                     try:
-                                        args = json.loads(buf.get("args_str", "{}"))
+                                        args = json.loads(args_str or "{}")
                                     except json.JSONDecodeError:
                                         args = {}
                                     
@@ -200,7 +347,7 @@ class StreamHandler:
                                         "type": "function",
                                         "function": {
                                             "name": buf["name"],
-                                            "arguments": buf.get("args_str", "{}")
+                                            "arguments": args_str
                                         }
                                     })
                                     
@@ -220,7 +367,12 @@ class StreamHandler:
                                     
                                     # Execute the tool
                                     result = execute_tool(buf["name"], args)
-                                    tool_results[key] = result
+                                    output = result.get("output", "") if result.get("success") else json.dumps(result)
+                                    tool_reply_msgs.append({
+                                        "role": "tool",
+                                        "tool_call_id": buf.get("id", key),
+                                        "content": output
+                                    })
                                     
                                     # Send tool result event
                                     self._send_event({
@@ -242,74 +394,43 @@ class StreamHandler:
                             
                             # Add assistant message with tool_calls
                             assistant_msg: Dict[str, Any] = {"role": "assistant"}
-                            if collected_reasoning:
-                                assistant_msg["reasoning_content"] = collected_reasoning
-                            assistant_msg["content"] = collected_content or ""
+                            if reasoning_parts:
+                                assistant_msg["reasoning_content"] = "".join(reasoning_parts)
+                            assistant_msg["content"] = "".join(content_parts)
                             assistant_msg["tool_calls"] = collected_tool_calls
                             messages.append(assistant_msg)
-                            
-                            # Add tool results
-                            for key, buf in tool_call_buffer.items():
-                                if buf.get("name") and key in tool_results:
-                                    result = tool_results[key]
-                                    output = result.get("output", "") if result.get("success") else json.dumps(result)
-                                    messages.append({
-                                        "role": "tool",
-                                        "tool_call_id": buf.get("id", key),
-                                        "content": output
-                                    })
+                            messages.extend(tool_reply_msgs)
                             
                             # Make follow-up request by continuing the conversation.
                             body["messages"] = messages
-                            try:
-                                # Send continuation event
-                                self._send_event({"type": "continuation", "status": "starting", "request_id": request_id})
+                            # Send continuation event
+                            self._send_event({"type": "continuation", "status": "starting", "request_id": request_id})
 
-                                # Before switching to the next upstream request, emit an estimate for the next prompt
-                                # so the UI can reflect the larger context window immediately.
-                                if last_usage is None:
-                                    try:
-                                        next_prompt_text = json.dumps(body.get("messages", []), ensure_ascii=False)
-                                    except Exception:
-                                        next_prompt_text = ""
-                                    next_prompt_tokens = self._estimate_tokens(next_prompt_text)
-                                    self._send_event({
-                                        "type": "usage",
-                                        "usage": {
-                                            "prompt_tokens": next_prompt_tokens,
-                                            "completion_tokens": 0,
-                                            "total_tokens": next_prompt_tokens,
-                                        },
-                                        "estimated": True,
-                                        "request_id": request_id,
-                                    })
+                            # Before switching to the next upstream request, emit an estimate for the next prompt
+                            # so the UI can reflect the larger context window immediately.
+                            if last_usage is None:
+                                next_prompt_tokens = self._estimate_prompt_tokens(body.get("messages"))
+                                self._send_event({
+                                    "type": "usage",
+                                    "usage": {
+                                        "prompt_tokens": next_prompt_tokens,
+                                        "completion_tokens": 0,
+                                        "total_tokens": next_prompt_tokens,
+                                    },
+                                    "estimated": True,
+                                    "request_id": request_id,
+                                })
 
-                                # IMPORTANT: do NOT issue an extra upstream request here.
-                                # The recursive call below will create the next upstream stream.
-                                try:
-                                    resp.close()
-                                except Exception:
-                                    pass
-
-                                print(f"[DEBUG] ({request_id}) continuing after tool execution; remaining={max_iterations-1}", file=sys.stderr, flush=True)
-                                self.handle_streaming(body, is_first=False, max_iterations=max_iterations - 1)
-                                return
-                            except ProxyError as e:
-                                print(f"[DEBUG] ({request_id}) follow-up error: {e}", file=sys.stderr, flush=True)
-                                self._send_event({"type": "error", "message": f"Tool follow-up failed: {e}", "where": "upstream", "request_id": request_id})
-                                self._write(b"data: [DONE]\n\n")
-                                return
+                            print(f"[DEBUG] ({request_id}) continuing after tool execution; remaining={max_iterations-1}", file=sys.stderr, flush=True)
+                            # resp is closed by the finally below; the caller opens the next stream.
+                            return True
                         else:
                             # No tool calls. If upstream didn't provide usage, emit a best-effort estimate
                             # so the frontend can show token/context window stats.
                             if last_usage is None:
-                                try:
-                                    prompt_text = json.dumps(body.get("messages", []), ensure_ascii=False)
-                                except Exception:
-                                    prompt_text = ""
-                                completion_text = (collected_reasoning or "") + (collected_content or "")
-                                prompt_tokens = self._estimate_tokens(prompt_text)
-                                completion_tokens = self._estimate_tokens(completion_text)
+                                # messages are unchanged since the prompt estimate was taken.
+                                prompt_tokens = _prompt_tokens_estimate
+                                completion_tokens = self._estimate_tokens_from_chars(completion_chars)
                                 last_usage = {
                                     "prompt_tokens": prompt_tokens,
                                     "completion_tokens": completion_tokens,
@@ -329,68 +450,97 @@ class StreamHandler:
                                     "request_id": request_id,
                                 })
 
-                            # Finally forward [DONE]
-                            self._write(line if isinstance(line, bytes) else line.encode("utf-8"))
+                            # Finally send [DONE] as a complete, canonical frame (the
+                            # upstream line lacks the blank line ending the event).
+                            self._write(b"data: [DONE]\n\n", force=True)
                         break
                     
-                    try:
-                        chunk = json.loads(data_str)
-                        # Capture usage if upstream provides it (some providers send it only in the final chunk).
-                        if isinstance(chunk, dict) and isinstance(chunk.get("usage"), dict):
-                            u = chunk.get("usage") or {}
-                            last_usage = {
-                                "prompt_tokens": u.get("prompt_tokens", 0),
-                                "completion_tokens": u.get("completion_tokens", 0),
-                                "total_tokens": u.get("total_tokens", 0),
-                                "estimated": False,
-                            }
-                        delta = chunk.get("choices", [{}])[0].get("delta", {})
-                        
-                        # Collect content
-                        if delta.get("content"):
-                            collected_content += delta["content"]
-                        
-                        # Collect reasoning_content
-                        if delta.get("reasoning_content"):
-                            collected_reasoning += delta["reasoning_content"]
-
-                        # Real-time estimate updates while streaming reasoning/content.
+                    fast = b'"delta"' in data and not any(k in data for k in _FULL_PARSE_KEYS)
+                    if fast:
+                        m = _DELTA_CONTENT_RE.search(data)
+                        if m is None:
+                            fast = _CONTENT_RE.search(data) is None
+                        else:
+                            try:
+                                text = json.loads(b'"' + m.group(1) + b'"')
+                            except json.JSONDecodeError:
+                                fast = False
+                            else:
+                                content_parts.append(text)
+                                completion_chars += len(text)
+                    if fast:
                         _maybe_emit_usage_estimate(force=False)
-                        
-                        # Collect tool calls
-                        if delta.get("tool_calls"):
-                            for tc in delta["tool_calls"]:
-                                idx = tc.get("index", 0)
-                                key = f"idx:{idx}"
-                                
-                                if key not in tool_call_buffer:
-                                    tool_call_buffer[key] = {
-                                        "id": "",
-                                        "name": "",
-                                        "args_str": ""
-                                    }
+                    else:
+                        try:
+                            chunk = json.loads(data)
+                            # Capture usage if upstream provides it (some providers send it only in the final chunk).
+                            u = chunk.get("usage") if isinstance(chunk, dict) else None
+                            if isinstance(u, dict):
+                                last_usage = {
+                                    "prompt_tokens": u.get("prompt_tokens", 0),
+                                    "completion_tokens": u.get("completion_tokens", 0),
+                                    "total_tokens": u.get("total_tokens", 0),
+                                    "estimated": False,
+                                }
+                            # Usage-only chunks may carry an empty choices list.
+                            choices = chunk.get("choices")
+                            delta = choices[0].get("delta") if choices else None
+                            
+                            if delta:
+                                # Collect content
+                                content = delta.get("content")
+                                if content:
+                                    content_parts.append(content)
+                                    completion_chars += len(content)
                                 
-                                if tc.get("id"):
-                                    tool_call_buffer[key]["id"] = tc["id"]
-                                if tc.get("function", {}).get("name"):
-                                    tool_call_buffer[key]["name"] = tc["function"]["name"]
-                                if tc.get("function", {}).get("arguments"):
-                                    tool_call_buffer[key]["args_str"] += tc["function"]["arguments"]
-                    except json.JSONDecodeError:
-                        pass
+                                # Collect reasoning_content
+                                reasoning = delta.get("reasoning_content")
+                                if reasoning:
+                                    reasoning_parts.append(reasoning)
+                                    completion_chars += len(reasoning)
+
+                            # Real-time estimate updates while streaming reasoning/content.
+                            _maybe_emit_usage_estimate(force=False)
+                            
+                            # Collect tool calls
+                            if delta and delta.get("tool_calls"):
+                                for tc in delta["tool_calls"]:
+                                    idx = tc.get("index", 0)
+                                    key = f"idx:{idx}"
+                                    
+                                    if key not in tool_call_buffer:
+                                        tool_call_buffer[key] = {
+                                            "id": "",
+                                            "name": "",
+                                            # argument fragments, joined at [DONE]
+                                            "args_parts": []
+                                        }
+                                    
+                                    if tc.get("id"):
+                                        tool_call_buffer[key]["id"] = tc["id"]
+                                    func = tc.get("function")
+                                    if func:
+                                        if func.get("name"):
+                                            tool_call_buffer[key]["name"] = func["name"]
+                                        if func.get("arguments"):
+                                            tool_call_buffer[key]["args_parts"].append(func["arguments"])
+                        except json.JSONDecodeError:
+                            pass
                 
                 # Forward the line to client
-                if not self._write(line if isinstance(line, bytes) else line.encode("utf-8")):
+                if not self._write(line):
                     break
                     
         except Exception as e:
             print(f"[ERROR] ({request_id}) streaming error: {e}", file=sys.stderr, flush=True)
             self._send_event({"type": "error", "message": f"Streaming error: {e}", "where": "backend", "request_id": request_id})
         finally:
+            self._flush()
             try:
                 resp.close()
             except Exception:
                 pass
+        return False
     
     def handle_non_streaming(self, body: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -4,64 +4,80 @@ from __future__ import annotations
 
 import json
 import os
+import selectors
+import signal
 import subprocess
-from typing import Any, Dict, List
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 
-def get_tool_definitions() -> List[Dict[str, Any]]:
-    """Return all available tool definitions in OpenAI format."""
-    return [
-        {
-            "type": "function",
-            "function": {
-                "name": "run_shell_command",
-                "description": "Run a shell command in bash and get its output. Use this for quick commands. The 'command' argument is REQUIRED.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "command": {
-                            "type": "string",
-                            "description": "The bash command to run (REQUIRED)"
-                        }
-                    },
-                    "required": ["command"]
-                }
+# run_shell_command limits. Output beyond the cap is dropped and the command
+# killed, so a runaway command can't grow the backend without bound.
+_COMMAND_TIMEOUT = 60
+_MAX_COMMAND_OUTPUT = 1 << 20
+
+
+# Built once: the schemas never change and are sent with every chat request.
+_TOOL_DEFINITIONS: List[Dict[str, Any]] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "run_shell_command",
+            "description": "Run a shell command in bash and get its output. Use this for quick commands. The 'command' argument is REQUIRED.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "command": {
+                        "type": "string",
+                        "description": "The bash command to run (REQUIRED)"
+                    }
+                },
+                "required": ["command"]
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "get_shell_config",
-                "description": "Get the desktop shell configuration file contents",
-                "parameters": {
-                    "type": "object",
-                    "properties": {},
-                    "required": []
-                }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_shell_config",
+            "description": "Get the desktop shell configuration file contents",
+            "parameters": {
+                "type": "object",
+                "properties": {},
+                "required": []
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "set_shell_config",
-                "description": "Set a field in the desktop shell configuration file. Must use after get_shell_config.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "key": {
-                            "type": "string",
-                            "description": "The config key path, e.g. 'appearance.theme'"
-                        },
-                        "value": {
-                            "type": "string",
-                            "description": "The value to set"
-                        }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "set_shell_config",
+            "description": "Set a field in the desktop shell configuration file. Must use after get_shell_config.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "key": {
+                        "type": "string",
+                        "description": "The config key path, e.g. 'appearance.theme'"
                     },
-                    "required": ["key", "value"]
-                }
+                    "value": {
+                        "type": "string",
+                        "description": "The value to set"
+                    }
+                },
+                "required": ["key", "value"]
             }
         }
-    ]
+    }
+]
+
+
+def get_tool_definitions() -> List[Dict[str, Any]]:
+    """Return all available tool definitions in OpenAI format.
+
+    The same list is returned on every call; callers must not mutate it.
+    """
+    return _TOOL_DEFINITIONS
 
 
 def execute_tool(tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
@@ -69,26 +85,14 @@ def execute_tool(tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
     Execute a tool and return the result.
     Returns: {"success": bool, "output": str, "error": str | None}
     """
-    if tool_name == "run_shell_command":
-        return _run_shell_command(args)
-    elif tool_name == "get_shell_config":
-        return _get_shell_config(args)
-    elif tool_name == "set_shell_config":
-        return _set_shell_config(args)
-    elif tool_name == "switch_to_search_mode":
-        return {
-            "success": True,
-            "output": "Switched to search mode. Continue with the user's request.",
-            "error": None,
-            "action": "switch_mode",
-            "mode": "search"
-        }
-    else:
+    handler = _DISPATCH.get(tool_name)
+    if handler is None:
         return {
             "success": False,
             "output": "",
             "error": f"Unknown tool: {tool_name}"
         }
+    return handler(args)
 
 
 def _run_shell_command(args: Dict[str, Any]) -> Dict[str, Any]:
@@ -103,29 +107,41 @@ def _run_shell_command(args: Dict[str, Any]) -> Dict[str, Any]:
             "example": {"command": "fastfetch"}
         }
     try:
-        result = subprocess.run(
+        proc = subprocess.Popen(
             ["bash", "-c", command],
-            capture_output=True,
-            text=True,
-            timeout=60,
-            cwd=os.path.expanduser("~")
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=os.path.expanduser("~"),
+            start_new_session=True,
         )
-        output = result.stdout
-        if result.stderr:
-            output += f"\n[stderr]\n{result.stderr}"
-        output += f"\n\n[exit code: {result.returncode}]"
-        return {
-            "success": result.returncode == 0,
-            "output": output,
-            "error": None if result.returncode == 0 else f"Command exited with code {result.returncode}"
-        }
-    except subprocess.TimeoutExpired:
+    except Exception as e:
         return {
             "success": False,
             "output": "",
-            "error": "Command timed out after 60 seconds"
+            "error": str(e)
+        }
+    try:
+        stdout, stderr, truncated, timed_out = _collect_output(proc)
+        if timed_out:
+            return {
+                "success": False,
+                "output": "",
+                "error": f"Command timed out after {_COMMAND_TIMEOUT} seconds"
+            }
+        output = stdout.decode("utf-8", errors="replace")
+        if stderr:
+            output += f"\n[stderr]\n{stderr.decode('utf-8', errors='replace')}"
+        output += f"\n\n[exit code: {proc.returncode}]"
+        result = {
+            "success": proc.returncode == 0,
+            "output": output,
+            "error": None if proc.returncode == 0 else f"Command exited with code {proc.returncode}"
         }
+        if truncated:
+            result["truncated"] = True
+        return result
     except Exception as e:
+        _kill_process_group(proc)
         return {
             "success": False,
             "output": "",
@@ -133,15 +149,87 @@ def _run_shell_command(args: Dict[str, Any]) -> Dict[str, Any]:
         }
 
 
+def _collect_output(proc: subprocess.Popen) -> Tuple[bytes, bytes, bool, bool]:
+    """
+    Read a command's stdout/stderr until it exits, keeping at most
+    _MAX_COMMAND_OUTPUT bytes in total. The process group is killed if the
+    cap is hit or _COMMAND_TIMEOUT passes.
+    Returns (stdout, stderr, truncated, timed_out).
+    """
+    stdout = bytearray()
+    stderr = bytearray()
+    room = _MAX_COMMAND_OUTPUT
+    truncated = False
+    deadline = time.monotonic() + _COMMAND_TIMEOUT
+    with selectors.DefaultSelector() as sel:
+        sel.register(proc.stdout, selectors.EVENT_READ, stdout)
+        sel.register(proc.stderr, selectors.EVENT_READ, stderr)
+        while sel.get_map() and not truncated:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in sel.select(remaining):
+                chunk = os.read(key.fd, 65536)
+                if not chunk:
+                    sel.unregister(key.fileobj)
+                    continue
+                if len(chunk) > room:
+                    chunk = chunk[:room]
+                    truncated = True
+                key.data.extend(chunk)
+                room -= len(chunk)
+    proc.stdout.close()
+    proc.stderr.close()
+
+    timed_out = False
+    if truncated:
+        _kill_process_group(proc)
+    else:
+        try:
+            proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            _kill_process_group(proc)
+    return bytes(stdout), bytes(stderr), truncated, timed_out
+
+
+def _kill_process_group(proc: subprocess.Popen) -> None:
+    """Terminate a command started with start_new_session, and its children."""
+    for sig, wait in ((signal.SIGTERM, 2), (signal.SIGKILL, None)):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            pass
+        try:
+            proc.wait(timeout=wait)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+# get_shell_config output, keyed by the config file's (st_mtime_ns, st_size),
+# so repeated calls in a tool chain don't re-read and re-format the file.
+_config_cache: Optional[Tuple[Tuple[int, int], str]] = None
+
+
 def _get_shell_config(args: Dict[str, Any]) -> Dict[str, Any]:
     """Get the desktop shell configuration."""
+    global _config_cache
     config_path = os.path.expanduser("~/.config/illogical-impulse/config.json")
     try:
-        with open(config_path, "r") as f:
-            config = json.load(f)
+        st = os.stat(config_path)
+        key = (st.st_mtime_ns, st.st_size)
+        cached = _config_cache
+        if cached is not None and cached[0] == key:
+            output = cached[1]
+        else:
+            with open(config_path, "r") as f:
+                config = json.load(f)
+            output = json.dumps(config, indent=2)
+            _config_cache = (key, output)
         return {
             "success": True,
-            "output": json.dumps(config, indent=2),
+            "output": output,
             "error": None
         }
     except FileNotFoundError:
@@ -158,6 +246,11 @@ def _get_shell_config(args: Dict[str, Any]) -> Dict[str, Any]:
         }
 
 
+def _invalidate_config_cache() -> None:
+    global _config_cache
+    _config_cache = None
+
+
 def _set_shell_config(args: Dict[str, Any]) -> Dict[str, Any]:
     """Set a value in the desktop shell configuration."""
     key = args.get("key")
@@ -184,6 +277,7 @@ def _set_shell_config(args: Dict[str, Any]) -> Dict[str, Any]:
         
         with open(config_path, "w") as f:
             json.dump(config, f, indent=2)
+        _invalidate_config_cache()
         
         return {
             "success": True,
@@ -196,3 +290,25 @@ def _set_shell_config(args: Dict[str, Any]) -> Dict[str, Any]:
             "output": "",
             "error": str(e)
         }
+
+
+def _switch_to_search_mode(args: Dict[str, Any]) -> Dict[str, Any]:
+    """Tell the UI to switch to search mode."""
+    return _SWITCH_TO_SEARCH_MODE_RESULT
+
+
+_SWITCH_TO_SEARCH_MODE_RESULT: Dict[str, Any] = {
+    "success": True,
+    "output": "Switched to search mode. Continue with the user's request.",
+    "error": None,
+    "action": "switch_mode",
+    "mode": "search"
+}
+
+# Tool name -> implementation, used by execute_tool.
+_DISPATCH: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "run_shell_command": _run_shell_command,
+    "get_shell_config": _get_shell_config,
+    "set_shell_config": _set_shell_config,
+    "switch_to_search_mode": _switch_to_search_mode,
+}
@@ -2,11 +2,22 @@
 
 from __future__ import annotations
 
+import functools
+import http.client
 import json
 import os
+import ssl
+import threading
+import time
 import urllib.error
 import urllib.request
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib path produces the same JSON
+    orjson = None
 
 
 class ProxyError(Exception):
@@ -19,8 +30,11 @@ def _env(name: str, default: str = "") -> str:
     return default if v is None else v
 
 
-def _json_bytes(obj: Any) -> bytes:
-    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+if orjson is not None:
+    _json_bytes = orjson.dumps
+else:
+    def _json_bytes(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 
 
 def _join_url(base: str, path: str) -> str:
@@ -34,26 +48,176 @@ def _join_url(base: str, path: str) -> str:
     return b + path
 
 
+_REQUEST_TIMEOUT = 600
+# How long, and how many bytes, close() may spend reading the tail of a
+# finished stream (the final chunk after an SSE [DONE]) so its connection can
+# be reused.
+_DRAIN_TIMEOUT = 2
+_MAX_DRAIN = 65536
+# Seen in the body once the upstream has finished generating.
+_SSE_DONE = b"data: [DONE]"
+_MAX_IDLE_CONNECTIONS = 4
+# What sending on an idle keep-alive connection the server already closed
+# looks like: the write fails, or the status line never comes. Only these
+# mean the request was not taken, so only these are safe to send again.
+_STALE_CONNECTION_ERRORS = (http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+
+class _ConnectionPool:
+    """Keep-alive connections to a single upstream host.
+
+    Reusing a connection skips the TCP and TLS handshakes, which otherwise
+    cost a few hundred ms on every chat request and every tool round.
+    """
+
+    def __init__(self, scheme: str, host: str, port: Optional[int]) -> None:
+        self._host = host
+        self._port = port
+        if scheme == "https":
+            # One SSL context for every connection: building a default context
+            # loads the system CA bundle, which is too slow to do per connect.
+            context = ssl.create_default_context()
+            self._connect = functools.partial(http.client.HTTPSConnection, context=context)
+        else:
+            self._connect = http.client.HTTPConnection
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> tuple:
+        """Return (connection, reused)."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self.connect(), False
+
+    def connect(self) -> http.client.HTTPConnection:
+        """Return a new, unpooled connection."""
+        return self._connect(self._host, self._port, timeout=_REQUEST_TIMEOUT)
+
+    def release(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if len(self._idle) < _MAX_IDLE_CONNECTIONS:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+
+class PooledResponse:
+    """An upstream response that returns its connection to the pool once done.
+
+    The connection is released when the body has been read to the end or
+    close() is called, whichever comes first. Closing a response that is
+    still generating (e.g. the client hung up) drops the connection instead:
+    draining it would wait out, and pay for, the rest of the generation.
+    """
+
+    def __init__(
+        self,
+        pool: _ConnectionPool,
+        conn: http.client.HTTPConnection,
+        resp: http.client.HTTPResponse,
+    ) -> None:
+        self._pool = pool
+        self._conn: Optional[http.client.HTTPConnection] = conn
+        self._resp = resp
+        self._finished = False
+        self.status = resp.status
+
+    def readline(self, limit: int = -1) -> bytes:
+        line = self._resp.readline(limit)
+        if not line:
+            self.close()
+        elif not self._finished and _SSE_DONE in line:
+            self._finished = True
+        return line
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        data = self._resp.read(amt)
+        if amt is None or not data:
+            self.close()
+        elif not self._finished and _SSE_DONE in data:
+            self._finished = True
+        return data
+
+    def read1(self, n: int = -1) -> bytes:
+        data = self._resp.read1(n)
+        if not data:
+            self.close()
+        elif not self._finished and _SSE_DONE in data:
+            self._finished = True
+        return data
+
+    def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        resp = self._resp
+        reusable = False
+        try:
+            if resp.isclosed() or (self._finished and self._drain(conn)):
+                reusable = not resp.will_close
+        except Exception:
+            reusable = False
+        resp.close()
+        if reusable:
+            self._pool.release(conn)
+        else:
+            conn.close()
+
+    def _drain(self, conn: http.client.HTTPConnection) -> bool:
+        """Read the tail of a finished stream, within _DRAIN_TIMEOUT and _MAX_DRAIN."""
+        resp = self._resp
+        sock = conn.sock
+        if sock is None:
+            return False
+        deadline = time.monotonic() + _DRAIN_TIMEOUT
+        drained = 0
+        while not resp.isclosed():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or drained > _MAX_DRAIN:
+                return False
+            sock.settimeout(remaining)
+            data = resp.read1(8192)
+            if not data:
+                break
+            drained += len(data)
+        sock.settimeout(_REQUEST_TIMEOUT)
+        return True
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._resp, name)
+
+
 class UpstreamClient:
     """Client for proxying requests to upstream OpenAI-compatible API."""
-    
+
     def __init__(self) -> None:
         self.base_url = _env("OPENAI_BASE_URL", "").strip() or "https://api.openai.com"
         self.api_key = _env("OPENAI_API_KEY", "").strip()
 
+        self._url = _join_url(self.base_url, "/chat/completions")
+        parts = urlsplit(self._url)
+        self._path = parts.path + (f"?{parts.query}" if parts.query else "")
+        # urllib honours *_proxy env vars and http.client doesn't, so keep
+        # using urllib whenever a proxy applies to the upstream host.
+        self._pool: Optional[_ConnectionPool] = None
+        if parts.scheme in ("http", "https") and parts.hostname:
+            proxied = parts.scheme in urllib.request.getproxies() and not urllib.request.proxy_bypass(parts.hostname)
+            if not proxied:
+                self._pool = _ConnectionPool(parts.scheme, parts.hostname, parts.port)
+
     def health(self) -> Dict[str, Any]:
         return {
             "upstream_base_url": self.base_url,
             "has_api_key": bool(self.api_key),
         }
 
-    def request_chat_completions(self, body: Dict[str, Any]) -> urllib.response.addinfourl:
+    def request_chat_completions(self, body: Dict[str, Any]) -> Any:
         """
         Make a chat completions request to upstream.
         Returns the raw response object for streaming.
         Raises ProxyError on failure.
         """
-        url = _join_url(self.base_url, "/chat/completions")
         headers = {
             "Content-Type": "application/json",
             "Accept": "text/event-stream" if body.get("stream") else "application/json",
@@ -61,9 +225,51 @@ class UpstreamClient:
         if self.api_key:
             headers["Authorization"] = f"Bearer {self.api_key}"
         data = _json_bytes(body)
-        req = urllib.request.Request(url=url, data=data, headers=headers, method="POST")
+        if self._pool is None:
+            return self._request_urllib(data, headers)
+        return self._request_pooled(data, headers)
+
+    def _request_pooled(self, data: bytes, headers: Dict[str, str]) -> PooledResponse:
+        pool = self._pool
+        conn, reused = pool.acquire()
+        try:
+            conn.request("POST", self._path, body=data, headers=headers)
+            resp = conn.getresponse()
+        except _STALE_CONNECTION_ERRORS as e:
+            conn.close()
+            if not reused:
+                raise ProxyError(f"Upstream URLError: {e}")
+            # The server had dropped this idle connection, so the request
+            # never reached it: send it once more, on a new connection. Any
+            # other failure may come after upstream took the request, and
+            # the POST isn't idempotent.
+            conn = pool.connect()
+            resp = self._send(conn, data, headers)
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            raise ProxyError(f"Upstream URLError: {e}")
+
+        if resp.status >= 400:
+            try:
+                err = resp.read().decode("utf-8", errors="replace")
+            except Exception:
+                err = resp.reason
+            conn.close()
+            raise ProxyError(f"Upstream HTTPError {resp.status}: {err}")
+        return PooledResponse(pool, conn, resp)
+
+    def _send(self, conn: http.client.HTTPConnection, data: bytes, headers: Dict[str, str]) -> http.client.HTTPResponse:
+        try:
+            conn.request("POST", self._path, body=data, headers=headers)
+            return conn.getresponse()
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            raise ProxyError(f"Upstream URLError: {e}")
+
+    def _request_urllib(self, data: bytes, headers: Dict[str, str]) -> Any:
+        req = urllib.request.Request(url=self._url, data=data, headers=headers, method="POST")
         try:
-            return urllib.request.urlopen(req, timeout=600)
+            return urllib.request.urlopen(req, timeout=_REQUEST_TIMEOUT)
         except urllib.error.HTTPError as e:
             try:
                 err = e.read().decode("utf-8", errors="replace")
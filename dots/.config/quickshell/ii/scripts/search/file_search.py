@@ -1,43 +1,62 @@
 #!/usr/bin/env python3
 
 import argparse
+import functools
+import heapq
 import json
 import os
+import re
 import shlex
 import stat
 import subprocess
 import sys
-from urllib.parse import unquote, urlparse
+import tempfile
+from typing import Callable
+from urllib.parse import unquote
 
 
-def _which(cmd: str) -> str | None:
+@functools.lru_cache(maxsize=None)
+def _which(*cmds: str) -> str | None:
+    # First of `cmds` on PATH, in order of preference, found in a single
+    # PATH walk: an earlier name wins even if it sits in a later directory.
+    best = None
+    best_rank = len(cmds)
     for p in os.environ.get("PATH", "").split(os.pathsep):
-        candidate = os.path.join(p, cmd)
-        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
-            return candidate
-    return None
+        for rank in range(best_rank):
+            candidate = os.path.join(p, cmds[rank])
+            if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                best, best_rank = candidate, rank
+                break
+        if best_rank == 0:
+            break
+    return best
+
+
+# Path part of a file:// URL, as urlparse() would split it: after the
+# authority, up to any query or fragment.
+_FILE_URL_RE = re.compile(r"file://[^/?#]*([^?#]*)")
 
 
 def _normalize_path(line: str) -> str | None:
+    # Runs for every candidate line, so avoid urlparse() for the common case
+    # of a plain absolute path (all plocate ever prints).
     s = line.strip("\r\n")
     if not s:
         return None
-    if s.startswith("file://"):
-        try:
-            u = urlparse(s)
-            if u.scheme != "file":
-                return None
-            return unquote(u.path)
-        except Exception:
-            return None
-    if s.startswith("/"):
+    if s[0] == "/":
         return s
-    return None
+    m = _FILE_URL_RE.match(s)
+    if m is None:
+        return None
+    p = m.group(1)
+    return unquote(p) if "%" in p else p
 
 
-def _contains_all(haystack: str, needles: list[str]) -> bool:
+def _contains_all(haystack: str, needles: tuple[str, ...]) -> bool:
+    # `needles` must not contain empty strings (see main()). A plain loop of
+    # `in` tests beats both all(<genexpr>) and a lookahead regex here.
     for n in needles:
-        if n and n not in haystack:
+        if n not in haystack:
             return False
     return True
 
@@ -50,63 +69,202 @@ def _strip_filter_prefix(s: str) -> str:
     return s
 
 
-def _prefix_match(path: str, prefix: str) -> bool:
+def _compile_prefixes(prefixes: list[str]) -> Callable[[str], bool] | None:
     # Treat prefixes as directory prefixes, not plain string prefixes.
     # Ex: /home/u/.gradle should match /home/u/.gradle/... but not /home/u/.gradleX
-    p = (prefix or "").rstrip("/")
-    if not p:
-        return False
-    if path == p:
-        return True
-    return path.startswith(p + "/")
+    # The stripped and slash-terminated forms are built once; each path is then
+    # checked with one set lookup and one str.startswith() over all of them.
+    exact = frozenset(p for p in (x.rstrip("/") for x in prefixes) if p)
+    if not exact:
+        return None
+    dirs = tuple(p + "/" for p in exact)
+    return lambda path: path in exact or path.startswith(dirs)
 
 
-def _fuzzy_match(path_lower: str, token_lower: str) -> bool:
-    if not token_lower:
-        return False
+def _compile_fuzzy(tokens_lower: list[str]) -> tuple[tuple[str, ...], frozenset[str]] | None:
     # Match against path segments to avoid excluding files like "build.gradle"
-    # when token is a hidden dir like ".gradle".
-    segs = [s for s in path_lower.split("/") if s]
-    if token_lower.startswith("."):
-        return any(s == token_lower for s in segs)
-    return any(token_lower in s for s in segs)
+    # when token is a hidden dir like ".gradle": dotted tokens must equal a whole
+    # segment, others only need to occur within one. Tokens spanning a "/" can't
+    # lie within a single segment and never match.
+    # Returns (substring tokens, whole-segment tokens) for _fuzzy_match().
+    substr = []
+    segment = []
+    for t in tokens_lower:
+        if not t or "/" in t:
+            continue
+        (segment if t.startswith(".") else substr).append(t)
+    if not substr and not segment:
+        return None
+    return tuple(substr), frozenset(segment)
 
 
-def _score(path: str, name: str, needles: list[str]) -> int:
-    # Cheap heuristic score for stable ordering.
-    s = 0
-    lp = path.lower()
-    ln = name.lower()
-    for n in needles:
-        if not n:
+def _fuzzy_match(lp: str, segs: list[str], tokens: tuple[tuple[str, ...], frozenset[str]]) -> bool:
+    # `lp` is the lowercased path and `segs` its "/"-separated segments, split
+    # once per path by the caller. A substring token holds no "/", so finding
+    # it in the whole path means it lies within one segment.
+    substr, segment = tokens
+    for t in substr:
+        if t in lp:
+            return True
+    # One set probe per segment rather than a list scan per token.
+    return not segment.isdisjoint(segs)
+
+
+def _prune_prefixes(prefixes: list[str]) -> list[str]:
+    # With directory-prefix matching, "/a/b" adds nothing next to "/a"; drop
+    # such nested entries once instead of testing them per candidate.
+    # A prefix that strips down to "" never matches, so it nests nothing.
+    roots = {p.rstrip("/") for p in prefixes}
+    roots.discard("")
+    return [p for p in prefixes if not any(p.rstrip("/").startswith(r + "/") for r in roots)]
+
+
+def _prune_fuzzy(tokens_lower: list[str]) -> list[str]:
+    # A token containing a substring token can only match paths that one
+    # matches too (see _compile_fuzzy()), so it is dropped. Dotted tokens must
+    # equal a whole segment and tokens with "/" never match: neither covers
+    # any other token.
+    substr = [t for t in tokens_lower if not t.startswith(".") and "/" not in t]
+    return [t for t in tokens_lower if not any(s != t and s in t for s in substr)]
+
+
+# Candidates are type-checked in batches of this many paths.
+_STAT_BATCH = 256
+# Siblings needed before their directory is listed instead of stat()ing each.
+_SCANDIR_MIN = 8
+
+
+def _stat_type(path: str) -> tuple[bool, bool] | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return stat.S_ISDIR(st.st_mode), stat.S_ISREG(st.st_mode)
+
+
+def _path_types(paths: list[str]) -> dict[str, tuple[bool, bool]]:
+    # (is_dir, is_file) for each path that exists, following symlinks.
+    # Index hits cluster under a few directories (e.g. ~/.gradle/caches/...),
+    # so when enough of them share a parent, one os.scandir() of the parent
+    # replaces their stat() calls: DirEntry knows its type from the directory
+    # listing. Symlinks, and anything else not found that way, are stat()ed,
+    # except paths already known to be directories: a listed directory, or
+    # one holding another candidate that exists.
+    by_parent: dict[str, dict[str, str]] = {}
+    for path in paths:
+        parent, name = os.path.split(path)
+        if name and name not in (".", ".."):
+            by_parent.setdefault(parent, {})[name] = path
+
+    types: dict[str, tuple[bool, bool]] = {}
+    dirs: set[str] = set()
+    for parent, wanted in by_parent.items():
+        if len(wanted) < _SCANDIR_MIN:
             continue
-        if ln == n:
-            s += 200
-        elif ln.startswith(n):
-            s += 120
-        elif n in ln:
-            s += 80
-        elif n in lp:
-            s += 30
-    # Prefer shorter paths slightly
-    s -= min(30, len(path) // 20)
-    return s
+        remaining = len(wanted)
+        try:
+            with os.scandir(parent) as it:
+                dirs.add(parent)
+                for entry in it:
+                    path = wanted.get(entry.name)
+                    if path is None:
+                        continue
+                    try:
+                        # A dangling symlink must drop out as it would with stat().
+                        if not entry.is_symlink():
+                            types[path] = (entry.is_dir(follow_symlinks=False), entry.is_file(follow_symlinks=False))
+                    except OSError:
+                        pass
+                    remaining -= 1
+                    if not remaining:
+                        break
+        except OSError:
+            pass
+
+    # Index order puts a directory before its contents; walking backwards
+    # settles the contents first, so the directory needs no stat() of its own.
+    for path in reversed(paths):
+        if path in types:
+            continue
+        if path in dirs:
+            types[path] = (True, False)
+        else:
+            t = _stat_type(path)
+            if t is None:
+                continue
+            types[path] = t
+        dirs.add(os.path.dirname(path))
+    return types
 
 
-def _run(cmd: list[str]) -> tuple[int, str, str]:
+def _make_scorer(needles: list[str]):
+    # Cheap heuristic score for stable ordering.
+    # Tiers per needle: name equals (200) > name starts with (120) >
+    # name contains (80) > path contains (30). The name substring test
+    # goes first, since most needles miss the name and then only the
+    # path test is left. `lp` and `ln` are the lowercased path and name,
+    # which the caller already has.
+    needles = tuple(n for n in needles if n)
+
+    def score(path: str, lp: str, ln: str) -> int:
+        # Prefer shorter paths slightly
+        s = -min(30, len(path) // 20)
+        for n in needles:
+            if n in ln:
+                if ln == n:
+                    s += 200
+                elif ln.startswith(n):
+                    s += 120
+                else:
+                    s += 80
+            elif n in lp:
+                s += 30
+        return s
+
+    return score
+
+
+def _spawn(cmd: list[str]) -> tuple[subprocess.Popen | None, str]:
+    # Output is read line by line as it arrives, so the caller can stop early
+    # instead of buffering the whole candidate list. stderr goes to a temp file
+    # rather than a pipe: nothing reads it until stdout is done, and a chatty
+    # command would block on a full pipe and never finish its stdout.
+    err_file = tempfile.TemporaryFile("w+", errors="replace")
     try:
-        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace")
-        return p.returncode, p.stdout, p.stderr
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err_file, text=True, errors="replace")
     except FileNotFoundError:
-        return 127, "", f"command not found: {cmd[0]}\n"
+        err_file.close()
+        return None, f"command not found: {cmd[0]}\n"
     except Exception as e:
-        return 1, "", f"failed to run {cmd[0]}: {e}\n"
+        err_file.close()
+        return None, f"failed to run {cmd[0]}: {e}\n"
+    # Popen leaves .stderr unset for a file; keep ours there for _finish/_stop.
+    p.stderr = err_file
+    return p, ""
+
+
+def _finish(p: subprocess.Popen) -> tuple[int, str]:
+    # The caller has read stdout to EOF.
+    p.stdout.close()
+    code = p.wait()
+    p.stderr.seek(0)
+    err = p.stderr.read()
+    p.stderr.close()
+    return code, err
 
 
-def _plocate_candidates(seed: str, scope: str, limit: int, has_path_filters: bool) -> tuple[int, list[str], str]:
+def _stop(p: subprocess.Popen) -> None:
+    # The caller has enough candidates; don't let the command run on.
+    p.stdout.close()
+    p.stderr.close()
+    p.terminate()
+    p.wait()
+
+
+def _plocate_candidates(words: list[str], scope: str, limit: int, has_path_filters: bool) -> tuple[int, subprocess.Popen | None, str]:
     plocate = _which("plocate")
     if not plocate:
-        return 127, [], "plocate not found"
+        return 127, None, "plocate not found"
 
     # Pull a larger candidate set; we'll filter down.
     # IMPORTANT: when include/exclude filters are present, the first N hits can be entirely
@@ -115,18 +273,22 @@ def _plocate_candidates(seed: str, scope: str, limit: int, has_path_filters: boo
     raw_limit = max(limit * (400 if has_path_filters else 10), 8000 if has_path_filters else 200)
     cmd = [plocate, "-i", "-l", str(raw_limit)]
     cmd.append("-b" if scope == "name" else "-w")
-    cmd.append(seed)
+    # plocate only prints entries matching every pattern, so the AND over all
+    # words happens in the index rather than on our side of the pipe.
+    # "--" so a word starting with "-" is taken as a pattern, not an option.
+    cmd.append("--")
+    cmd += words
 
-    code, out, err = _run(cmd)
-    if code != 0:
-        return code, [], (err.strip() or out.strip() or "plocate failed")
-    return 0, out.splitlines(), ""
+    p, err = _spawn(cmd)
+    if p is None:
+        return 127, None, (err.strip() or "plocate failed")
+    return 0, p, ""
 
 
-def _baloo_candidates(query_terms: list[str], limit: int, include_dir: str | None, has_path_filters: bool) -> tuple[int, list[str], str]:
-    baloo = _which("baloosearch6") or _which("baloosearch")
+def _baloo_candidates(query_terms: list[str], limit: int, include_dir: str | None, has_path_filters: bool) -> tuple[int, subprocess.Popen | None, str]:
+    baloo = _which("baloosearch6", "baloosearch")
     if not baloo:
-        return 127, [], "baloosearch not found"
+        return 127, None, "baloosearch not found"
 
     # Pull a larger candidate set; Baloo may return content matches first.
     raw_limit = max(limit * (120 if has_path_filters else 50), 1500 if has_path_filters else 500)
@@ -137,10 +299,10 @@ def _baloo_candidates(query_terms: list[str], limit: int, include_dir: str | Non
     # baloosearch takes a list of query terms.
     cmd += query_terms
 
-    code, out, err = _run(cmd)
-    if code != 0:
-        return code, [], (err.strip() or out.strip() or "baloosearch failed")
-    return 0, out.splitlines(), ""
+    p, err = _spawn(cmd)
+    if p is None:
+        return 127, None, (err.strip() or "baloosearch failed")
+    return 0, p, ""
 
 
 def main() -> int:
@@ -165,12 +327,10 @@ def main() -> int:
     include_raw = [p for p in (args.include or []) if isinstance(p, str) and p]
     exclude_raw = [p for p in (args.exclude or []) if isinstance(p, str) and p]
 
-    include_abs: list[str] = []
-    include_fuzzy: list[str] = []
-    exclude_abs: list[str] = []
-    exclude_fuzzy: list[str] = []
-
-    def ingest(raw_list: list[str], abs_out: list[str], fuzzy_out: list[str]):
+    # Filters are collected as dict keys: deduplicated, in first-seen order.
+    def ingest(raw_list: list[str]) -> tuple[list[str], list[str]]:
+        abs_out: dict[str, None] = {}
+        fuzzy_out: dict[str, None] = {}
         for raw in raw_list:
             s = _strip_filter_prefix(str(raw).strip())
             s = s.strip()
@@ -178,28 +338,27 @@ def main() -> int:
                 continue
             s = os.path.expanduser(s)
             if os.path.isabs(s):
-                abs_out.append(os.path.normpath(s))
+                abs_out[os.path.normpath(s)] = None
             else:
-                fuzzy_out.append(s.lower())
+                fuzzy_out[s.lower()] = None
+        return _prune_prefixes(list(abs_out)), _prune_fuzzy(list(fuzzy_out))
 
-    ingest(include_raw, include_abs, include_fuzzy)
-    ingest(exclude_raw, exclude_abs, exclude_fuzzy)
-
-    # Dedup
-    include_abs = list(dict.fromkeys([p for p in include_abs if p]))
-    exclude_abs = list(dict.fromkeys([p for p in exclude_abs if p]))
-    include_fuzzy = list(dict.fromkeys([t for t in include_fuzzy if t]))
-    exclude_fuzzy = list(dict.fromkeys([t for t in exclude_fuzzy if t]))
+    include_abs, include_fuzzy = ingest(include_raw)
+    exclude_abs, exclude_fuzzy = ingest(exclude_raw)
 
     has_path_filters = bool(include_abs or include_fuzzy or exclude_abs or exclude_fuzzy)
 
-    # Choose a seed for plocate; pass all words to baloo.
-    seed = max(words, key=len)
+    include_abs_match = _compile_prefixes(include_abs)
+    include_fuzzy_tokens = _compile_fuzzy(include_fuzzy)
+    exclude_abs_match = _compile_prefixes(exclude_abs)
+    exclude_fuzzy_tokens = _compile_fuzzy(exclude_fuzzy)
+    # Only whole-segment tokens need the path split into segments.
+    split_segments = any(t and t[1] for t in (include_fuzzy_tokens, exclude_fuzzy_tokens))
 
-    lines: list[str] = []
+    proc: subprocess.Popen | None = None
     err_msg = ""
     if args.backend == "plocate":
-        code, lines, err_msg = _plocate_candidates(seed, args.scope, args.limit, has_path_filters)
+        code, proc, err_msg = _plocate_candidates(words, args.scope, args.limit, has_path_filters)
         if code != 0:
             print(err_msg, file=sys.stderr)
             return code
@@ -215,7 +374,7 @@ def main() -> int:
         else:
             query_terms = words
 
-        code, lines, err_msg = _baloo_candidates(query_terms, args.limit, include_dir, has_path_filters)
+        code, proc, err_msg = _baloo_candidates(query_terms, args.limit, include_dir, has_path_filters)
         if code != 0:
             print(err_msg, file=sys.stderr)
             return code
@@ -223,6 +382,8 @@ def main() -> int:
     results = []
     seen = set()
     needles = [w.lower() for w in words]
+    score = _make_scorer(needles)
+    match_needles = tuple(n for n in needles if n)
 
     # How many "survivor" candidates to collect before sorting.
     # With path filters enabled, early candidates can be dominated by unwanted locations
@@ -231,85 +392,131 @@ def main() -> int:
     target_survivors = max(target_survivors, args.limit * 3)
     target_survivors = min(target_survivors, 1500)
 
-    def collect(apply_client_match_filter: bool) -> list[dict]:
-        out_results: list[dict] = []
-        for raw in lines:
+    # Baloo may need a looser fallback (see below). Paths that pass the
+    # include/exclude filters but fail the client-side match are kept here,
+    # with their lowercased form, so the fallback needn't re-read or re-filter.
+    loose: dict[str, str] | None = {} if args.backend == "baloo" and args.scope == "path" else None
+
+    def read_paths():
+        for raw in proc.stdout:
             path = _normalize_path(raw)
-            if not path:
-                continue
+            if path:
+                yield path
 
-            # Include/exclude filters
+    def filtered(paths):
+        # (path, lowercased path) for each path passing the include/exclude filters.
+        for path in paths:
             lp = path.lower()
+            segs = lp.split("/") if split_segments else []
             if include_abs or include_fuzzy:
                 ok = False
-                if include_abs and any(_prefix_match(path, p) for p in include_abs):
+                if include_abs_match and include_abs_match(path):
                     ok = True
-                if not ok and include_fuzzy and any(_fuzzy_match(lp, t) for t in include_fuzzy):
+                if not ok and include_fuzzy_tokens and _fuzzy_match(lp, segs, include_fuzzy_tokens):
                     ok = True
                 if not ok:
                     continue
 
-            if exclude_abs and any(_prefix_match(path, p) for p in exclude_abs):
+            if exclude_abs_match and exclude_abs_match(path):
                 continue
-            if exclude_fuzzy and any(_fuzzy_match(lp, t) for t in exclude_fuzzy):
+            if exclude_fuzzy_tokens and _fuzzy_match(lp, segs, exclude_fuzzy_tokens):
                 continue
+            yield path, lp
 
-            # Client-side match filter (plocate always needs this; baloo may not)
-            if apply_client_match_filter:
-                target = path if args.scope == "path" else os.path.basename(path.rstrip("/"))
-                lt = target.lower()
-                if not _contains_all(lt, needles):
+    def collect(candidates, apply_client_match_filter: bool) -> list[dict]:
+        out_results: list[dict] = []
+        batch: list[str] = []
+        # Queued path -> its lowercased form, reused for scoring.
+        queued: dict[str, str] = {}
+
+        def flush_batch() -> bool:
+            # Type filter on the queued paths, in order. The type lookup also
+            # matters for type "any": it drops stale index entries and tells
+            # folders from files for the result.
+            # Returns True once enough survivors are collected.
+            types = _path_types(batch)
+            for path in batch:
+                t = types.get(path)
+                if t is None:
+                    continue
+                is_dir, is_file = t
+                if args.type == "dir" and not is_dir:
+                    continue
+                if args.type == "file" and not is_file:
                     continue
 
-            # Stat + type filter
-            try:
-                st = os.stat(path)
-            except OSError:
-                continue
+                seen.add(path)
+
+                if path == "/":
+                    parent = name = "/"
+                else:
+                    # One split instead of os.path.dirname() + basename(); the
+                    # rstrip mirrors dirname() dropping trailing slashes.
+                    head, sep, name = path.rstrip("/").rpartition("/")
+                    # Survivors tend to share a few parent directories; intern them
+                    # so those results hold one string instead of a copy each.
+                    parent = sys.intern(head.rstrip("/") or head + sep)
+
+                out_results.append({
+                    "path": path,
+                    "name": name,
+                    "parent": parent,
+                    "isDir": bool(is_dir),
+                    "isFile": bool(is_file),
+                    "score": score(path, queued[path], name.lower()),
+                })
+
+                if len(out_results) >= target_survivors:
+                    # Enough candidates for sorting; avoid walking too far.
+                    return True
+            batch.clear()
+            queued.clear()
+            return False
 
-            is_dir = stat.S_ISDIR(st.st_mode)
-            is_file = stat.S_ISREG(st.st_mode)
-            if args.type == "dir" and not is_dir:
-                continue
-            if args.type == "file" and not is_file:
-                continue
+        for path, lp in candidates:
+            # Client-side match filter. plocate already ANDs the words, so for it this
+            # is only a cheap check on case folding; baloo may not match on the name.
+            if apply_client_match_filter:
+                lt = lp if args.scope == "path" else os.path.basename(lp.rstrip("/"))
+                if not _contains_all(lt, match_needles):
+                    if loose is not None:
+                        loose.setdefault(path, lp)
+                    continue
 
-            # Dedup
-            if path in seen:
+            # Dedup before stat: a path already accepted or queued needs no second
+            # lookup, and one that gets rejected would be rejected again.
+            if path in seen or path in queued:
                 continue
-            seen.add(path)
-
-            nice = path.rstrip("/") if path != "/" else "/"
-            name = os.path.basename(nice) if nice != "/" else "/"
-            parent = os.path.dirname(nice) if nice != "/" else "/"
-
-            out_results.append({
-                "path": path,
-                "name": name,
-                "parent": parent,
-                "isDir": bool(is_dir),
-                "isFile": bool(is_file),
-                "score": _score(path, name, needles),
-            })
-
-            if len(out_results) >= target_survivors:
-                # Enough candidates for sorting; avoid walking too far.
+            queued[path] = lp
+            batch.append(path)
+            if len(batch) >= _STAT_BATCH and flush_batch():
                 break
+        else:
+            flush_batch()
         return out_results
 
     # For Baloo, we prefer consistent matching semantics, but Baloo's query terms
     # may hit file content/metadata. If strict substring matching yields nothing,
     # fall back to Baloo's own matching to avoid a blank result list.
     strict = True
-    results = collect(apply_client_match_filter=strict)
-    if not results and args.backend == "baloo" and args.scope == "path":
-        seen.clear()
-        results = collect(apply_client_match_filter=False)
-
-    results.sort(key=lambda r: r.get("score", 0), reverse=True)
-
-    for r in results[: args.limit]:
-        sys.stdout.write(json.dumps(r, ensure_ascii=False) + "\n")
+    results = collect(filtered(read_paths()), apply_client_match_filter=strict)
+    if len(results) >= target_survivors:
+        _stop(proc)
+    else:
+        code, err = _finish(proc)
+        if code != 0:
+            print(err.strip() or ("plocate failed" if args.backend == "plocate" else "baloosearch failed"), file=sys.stderr)
+            return code
+    if not results and loose:
+        # Nothing passed the strict match, so nothing was accepted either: the
+        # loose paths are exactly what a second unfiltered pass would queue.
+        results = collect(loose.items(), apply_client_match_filter=False)
+
+    # Only the top `limit` are printed; no need to sort the whole tail.
+    # nlargest keeps input order among equal scores, like a stable sort.
+    top = heapq.nlargest(args.limit, results, key=lambda r: r["score"])
+    # One write for the whole payload rather than one per record.
+    sys.stdout.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in top))
 
     return 0
 